@@ -28,6 +28,11 @@ class GrayAnnotator:
 
 class GrayVideoAnnotator(GrayAnnotator):
     def forward(self, frames):
+        if isinstance(frames, np.ndarray):
+            # contiguous [T, H, W, C] uint8 batch: converted in one call as a single tall image
+            t, h, w, c = frames.shape
+            gray_map = cv2.cvtColor(frames.reshape(t * h, w, c), cv2.COLOR_BGR2GRAY).reshape(t, h, w)
+            return np.repeat(gray_map[..., None], 3, axis=3)
         ret_frames = []
         for frame in frames:
             anno_frame = super().forward(np.array(frame))
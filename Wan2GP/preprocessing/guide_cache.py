@@ -0,0 +1,95 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+
+class GuideVideoCache:
+    """
+    On disk cache of annotated control videos (pose / depth / gray), stored as uint8 .npy files.
+    Entries are addressed by the content of the guide video plus every parameter that changes the annotated frames,
+    they are memory mapped when read back and the least recently used ones are evicted above max_size_mb.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=2048):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def set_max_size(self, max_size_mb):
+        self.max_size = max_size_mb * 1024 * 1024
+        self.evict()
+
+    def file_hash(self, file_path):
+        # hashing a video once per process is enough unless it is modified
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        file_hash = self.file_hashes.get(memo_key, None)
+        if file_hash == None:
+            hasher = hashlib.sha1()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    hasher.update(block)
+            file_hash = hasher.hexdigest()
+            self.file_hashes[memo_key] = file_hash
+        return file_hash
+
+    def get_key(self, file_path, process_type, **params):
+        key = [self.file_hash(file_path), process_type] + [f"{k}={params[k]}" for k in sorted(params)]
+        return hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            frames = np.load(path, mmap_mode="c")
+        except Exception as e:
+            print(f"Unable to read cached guide video '{path}': {e}")
+            return None
+        os.utime(path) # refresh the LRU position
+        return frames
+
+    def save(self, key, frames):
+        if self.max_size <= 0:
+            return
+        path = self.get_path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(frames, dtype=np.uint8))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            # the guide video has been processed, only the cache entry is lost
+            print(f"Unable to save cached guide video '{path}': {e}")
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith(".npy"):
+                    continue
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                except OSError:
+                    pass
@@ -77,6 +77,12 @@ class DepthAnnotator:
 
 class DepthVideoAnnotator(DepthAnnotator):
     def forward(self, frames):
+        if isinstance(frames, np.ndarray):
+            # contiguous [T, H, W, C] uint8 batch: annotations are written in place of a preallocated batch
+            ret_frames = np.empty_like(frames)
+            for i, frame in enumerate(frames):
+                ret_frames[i] = super().forward(frame)
+            return ret_frames
         ret_frames = []
         for frame in frames:
             anno_frame = super().forward(np.array(frame))
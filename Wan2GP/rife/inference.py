@@ -105,15 +105,105 @@ def process_frames(model, device, frames, exp):
     add_frame(output_frames, lastframe, h, w)
     return torch.cat( output_frames, dim=1)
 
-def temporal_interpolation(model_path, frames, exp, device ="cuda"):
-
-    model = Model()
-    model.load_model(model_path, -1, device=device)
+def interpolate_levels(model, I0, I1, exp, scale = 1):
+    # same frames as the recursive make_inference of process_frames, but each recursion level is a single batched inference
+    points = [I0, I1]
+    for _ in range(exp):
+        mids = model.inference(torch.cat(points[:-1]), torch.cat(points[1:]), scale).chunk(len(points) - 1)
+        new_points = [points[0]]
+        for mid, point in zip(mids, points[1:]):
+            new_points += [mid, point]
+        points = new_points
+    return points[1:-1]
+
+def pairs_ssim(frames_small):
+    # ssim of each frame thumbnail with the next one, computed in one pass
+    ssim = ssim_matlab(frames_small[:-1, :3], frames_small[1:, :3], size_average=False, val_range=1)
+    return ssim.flatten(1).mean(1)
+
+def process_frames_batched(model, device, frames, exp, batch_size = 4):
+    # batch_size consecutive pairs of frames are interpolated together, the static frames detection and the scene cut detection
+    # are computed on all the thumbnails of a batch at once and results are written directly into a preallocated output
+    _, frames_count, h, w = frames.shape
+    scale = 1
+    frames_per_pair = 2 ** exp
+    output_frames = torch.empty( (frames.shape[0], (frames_count - 1) * frames_per_pair + 1, h, w), dtype= frames.dtype)
+    if frames_count == 1:
+        output_frames[:, 0] = frames[:, 0].clip(-1., 1.)
+        return output_frames
 
-    model.eval()
-    model.to(device=device)
+    tmp = max(32, int(32 / scale))
+    ph = ((h - 1) // tmp + 1) * tmp
+    pw = ((w - 1) // tmp + 1) * tmp
+    padding = (0, pw - w, 0, ph - h)
 
-    with torch.no_grad():    
-        output = process_frames(model, device, frames.float(), exp)
+    def load_frames(start, end):
+        frames_slice = frames[:, start:end].to(device, non_blocking=True)
+        frames_slice = ((frames_slice + 1) / 2).clip(0., 1.)
+        return F.pad(frames_slice.transpose(0, 1), padding)
+
+    def thumbnails(frames_slice):
+        return F.interpolate(frames_slice, (32, 32), mode='bilinear', align_corners=False)
+
+    for start in range(0, frames_count - 1, batch_size):
+        end = min(start + batch_size, frames_count - 1) # pairs start .. end-1, frames start .. end
+        lo, hi = max(start - 1, 0), min(end + 2, frames_count)
+        source = load_frames(lo, hi)
+        current = source[start - lo: end - lo + 1]
+
+        # a frame nearly identical to its predecessor is replaced by the interpolation of its two neighbours
+        ssim = pairs_ssim(thumbnails(source))
+        frame_nos = torch.arange(start, end + 1, device=ssim.device)
+        static = (frame_nos >= 1) & (frame_nos <= frames_count - 2) & (ssim[(frame_nos - 1 - lo).clamp(min=0)] > 0.996)
+        static_nos = frame_nos[static]
+        if len(static_nos) > 0:
+            current = current.clone()
+            current[static_nos - start] = model.inference(source[static_nos - 1 - lo], source[static_nos + 1 - lo], scale)
+
+        I0, I1 = current[:-1], current[1:]
+        mids = interpolate_levels(model, I0, I1, exp, scale) if exp else []
+        # on a scene cut the first frame is repeated instead of being interpolated
+        scene_cut = (pairs_ssim(thumbnails(current)) < 0.2).view(-1, 1, 1, 1)
+        mids = [torch.where(scene_cut, I0, mid) for mid in mids]
+
+        batch_output = torch.stack([I0] + mids, dim=1)[..., :h, :w].flatten(0, 1)
+        batch_output = (batch_output * 2 - 1).clip(-1., 1.).transpose(0, 1)
+        output_frames[:, start * frames_per_pair: end * frames_per_pair] = batch_output.cpu()
+        last_frame = current[-1:, :, :h, :w]
+
+    output_frames[:, -1] = (last_frame[0] * 2 - 1).clip(-1., 1.).cpu()
+    return output_frames
+
+_models_cache = {}
+
+def get_model(model_path, device ="cuda", dtype = torch.float32):
+    # the flownet is kept loaded between calls (sliding windows, queued tasks) until release_models() is called
+    key = (os.path.abspath(model_path), str(device), dtype)
+    model = _models_cache.get(key, None)
+    if model == None:
+        model = Model()
+        model.load_model(model_path, -1, device=device)
+        model.eval()
+        model.to(device=device)
+        model.flownet.to(dtype=dtype)
+        _models_cache[key] = model
+    return model
+
+def release_models():
+    _models_cache.clear()
+
+def temporal_interpolation(model_path, frames, exp, device ="cuda", batch_size = None, dtype = torch.float32):
+
+    model = get_model(model_path, device=device, dtype=dtype)
+
+    if batch_size == None:
+        h, w = frames.shape[-2:]
+        batch_size = max(1, (4 * 1280 * 720) // (h * w))
+
+    with torch.no_grad():
+        if batch_size > 1:
+            output = process_frames_batched(model, device, frames.to(dtype), exp, batch_size = batch_size)
+        else:
+            output = process_frames(model, device, frames.to(dtype), exp)
 
     return output
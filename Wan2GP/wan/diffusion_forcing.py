@@ -18,7 +18,7 @@ from wan.modules.posemb_layers import get_rotary_pos_embed
 from wan.utils.utils import calculate_new_dimensions
 from .utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
                                get_sampling_sigmas, retrieve_timesteps)
-from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler, FlowUniPCBatchScheduler
 
 class DTT2V:
 
@@ -138,15 +138,14 @@ class DTT2V:
         if num_pre_ready > 0:
             pre_row[: num_pre_ready // casual_block_size] = num_iterations
 
+        frames_idx = torch.arange(num_frames_block, dtype=torch.long)
         while torch.all(pre_row >= (num_iterations - 1)) == False:
-            new_row = torch.zeros(num_frames_block, dtype=torch.long)
-            for i in range(num_frames_block):
-                if i == 0 or pre_row[i - 1] >= (
-                    num_iterations - 1
-                ):  # the first frame or the last frame is completely denoised
-                    new_row[i] = pre_row[i] + 1
-                else:
-                    new_row[i] = new_row[i - 1] - ar_step
+            # a frame starts a new run when it is the first frame or when the previous frame is completely denoised,
+            # it then advances by one step and each following frame of the run lags ar_step steps behind its predecessor
+            run_start = torch.ones(num_frames_block, dtype=torch.bool)
+            run_start[1:] = pre_row[:-1] >= (num_iterations - 1)
+            run_start_idx = torch.where(run_start, frames_idx, 0).cummax(0)[0]
+            new_row = pre_row[run_start_idx] + 1 - ar_step * (frames_idx - run_start_idx)
             new_row = new_row.clamp(0, num_iterations)
 
             update_mask.append(
@@ -164,13 +163,13 @@ class DTT2V:
             update_mask_idx = idx_sequence[update_mask]
             last_update_idx = update_mask_idx[-1].item()
             terminal_flag = last_update_idx + 1
+        step_update_mask = torch.stack(update_mask, dim=0)
         # for i in range(0, len(update_mask)):
-        for curr_mask in update_mask:
+        for curr_mask in step_update_mask.tolist():
             if terminal_flag < num_frames_block and curr_mask[terminal_flag]:
                 terminal_flag += 1
             valid_interval.append((max(terminal_flag - base_num_frames_block, 0), terminal_flag))
 
-        step_update_mask = torch.stack(update_mask, dim=0)
         step_index = torch.stack(step_index, dim=0)
         step_matrix = torch.stack(step_matrix, dim=0)
 
@@ -297,18 +296,22 @@ class DTT2V:
             predix_video_latent_length,
             causal_block_size,
         )
-        sample_schedulers = []
-        for _ in range(base_num_frames_iter):
-            sample_scheduler = FlowUniPCMultistepScheduler(
-                num_train_timesteps=1000, shift=1, use_dynamic_shifting=False
-            )
-            sample_scheduler.set_timesteps(sampling_steps, device=self.device, shift=shift)
-            sample_schedulers.append(sample_scheduler)
-        sample_schedulers_counter = [0] * base_num_frames_iter
+        # a single batched scheduler steps all the frames updated at each iteration, every frame keeping its own counter
+        sample_scheduler = FlowUniPCMultistepScheduler(
+            num_train_timesteps=1000, shift=1, use_dynamic_shifting=False
+        )
+        sample_scheduler.set_timesteps(sampling_steps, device=self.device, shift=shift)
+        sample_scheduler = FlowUniPCBatchScheduler(sample_scheduler, latents)
+        update_indexes = []
+        for update_mask_i, (valid_interval_start, valid_interval_end) in zip(step_update_mask, valid_interval):
+            indexes = torch.nonzero(update_mask_i[valid_interval_start:valid_interval_end]).flatten() + valid_interval_start
+            update_indexes.append(indexes.to(self.device))
 
         updated_num_steps=  len(step_matrix)
         if callback != None:
             callback(-1, None, True, override_num_inference_steps = updated_num_steps)
+        if self.model.enable_fbcache:
+            self.model.num_steps = updated_num_steps
         if self.model.enable_teacache:
             x_count = 2 if self.do_classifier_free_guidance else 1
             self.model.previous_residual = [None] * x_count 
@@ -338,7 +341,6 @@ class DTT2V:
             kwrags["slg_layers"] = slg_layers if int(slg_start * updated_num_steps) <= i < int(slg_end * updated_num_steps) else None
 
             offload.set_step_no_for_lora(self.model, i)
-            update_mask_i = step_update_mask[i]
             valid_interval_start, valid_interval_end = valid_interval[i]
             timestep = timestep_i[None, valid_interval_start:valid_interval_end].clone()
             latent_model_input = latents[:, valid_interval_start:valid_interval_end, :, :].clone()
@@ -398,20 +400,13 @@ class DTT2V:
                             return None
                     noise_pred = noise_pred_uncond + guide_scale * (noise_pred_cond - noise_pred_uncond)
                     del noise_pred_cond, noise_pred_uncond
-            for idx in range(valid_interval_start, valid_interval_end):
-                if update_mask_i[idx].item():
-                    latents[:, idx] = sample_schedulers[idx].step(
-                        noise_pred[:, idx - valid_interval_start],
-                        timestep_i[idx],
-                        latents[:, idx],
-                        return_dict=False,
-                        generator=generator,
-                    )[0]
-                    sample_schedulers_counter[idx] += 1
+            indexes = update_indexes[i]
+            if len(indexes) > 0:
+                latents[:, indexes] = sample_scheduler.step(noise_pred[:, indexes - valid_interval_start], latents[:, indexes], indexes)
             if callback is not None:
                 callback(i, latents.squeeze(0), False)         
 
         x0 = latents.unsqueeze(0)
-        videos = [self.vae.decode(x0, tile_size= VAE_tile_size)[0]]
+        videos = [self.vae.decode(x0, tile_size= VAE_tile_size, output_device= "cpu")[0]]
         output_video = videos[0].clamp(-1, 1).cpu()  # c, f, h, w
         return output_video
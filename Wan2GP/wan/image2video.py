@@ -407,7 +407,7 @@ class WanI2V:
                 callback(i, latent, False) 
 
         x0 = [latent]        
-        video = self.vae.decode(x0, VAE_tile_size, any_end_frame= any_end_frame and add_frames_for_end_image)[0]
+        video = self.vae.decode(x0, VAE_tile_size, any_end_frame= any_end_frame and add_frames_for_end_image, output_device= "cpu")[0]
 
         if any_end_frame and add_frames_for_end_image:
             # video[:,  -1:] = img_interpolated2
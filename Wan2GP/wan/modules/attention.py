@@ -1,4 +1,6 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import json
+import os
 import torch
 from importlib.metadata import version
 from mmgp import offload
@@ -117,7 +119,7 @@ def sdpa_wrapper(
 
 
 def get_attention_modes():
-    ret = ["sdpa", "auto"]
+    ret = ["sdpa", "auto", "autotune"]
     if flash_attn != None:
         ret.append("flash")
     if memory_efficient_attention != None:
@@ -146,17 +148,94 @@ __all__ = [
     'attention',
 ]
 
+_cu_seqlens_cache = {}
+
+def get_constant_cu_seqlens(values):
+    # cu_seqlens that only depend on the shapes are built once and then reused
+    cu_seqlens = _cu_seqlens_cache.get(values, None)
+    if cu_seqlens is None:
+        cu_seqlens = torch.tensor(values, dtype=torch.int32, device="cuda")
+        _cu_seqlens_cache[values] = cu_seqlens
+    return cu_seqlens
+
 def get_cu_seqlens(batch_size, lens, max_len):
+    # each sequence i is made of lens[i] tokens padded up to max_len: [0, lens[0], max_len, max_len + lens[1], 2 * max_len ...]
+    if lens is None:
+        return get_constant_cu_seqlens((0,) + tuple(v for i in range(batch_size) for v in ((i + 1) * max_len, (i + 1) * max_len)))
+    lens = torch.as_tensor(lens).to(device="cuda", dtype=torch.int32, non_blocking=True)
+    offsets = torch.arange(batch_size, dtype=torch.int32, device="cuda") * max_len
     cu_seqlens = torch.zeros([2 * batch_size + 1], dtype=torch.int32, device="cuda")
+    cu_seqlens[1::2] = offsets + lens
+    cu_seqlens[2::2] = offsets + max_len
+    return cu_seqlens
 
-    for i in range(batch_size):
-        s = lens[i] 
-        s1 = i * max_len + s
-        s2 = (i + 1) * max_len
-        cu_seqlens[2 * i + 1] = s1
-        cu_seqlens[2 * i + 2] = s2
 
-    return cu_seqlens
+class AttentionAutotuner:
+    """
+    Dispatches each attention call to the fastest installed attention mode for its shape. Every candidate is timed once
+    on the first call with a new (device, batch, lq, lk, heads, head dim, dtype) and the winners are saved in a json
+    file, so that the next sessions reuse them without benchmarking.
+    """
+
+    def __init__(self, cache_path, candidates = ("sdpa", "sage", "sage2", "flash")):
+        self.cache_path = cache_path
+        self.candidates = candidates
+        self.winners = None
+
+    def load(self):
+        self.winners = {}
+        if os.path.isfile(self.cache_path):
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    self.winners = json.load(f)
+            except Exception as e:
+                print(f"Unable to read the attention autotuning cache '{self.cache_path}': {e}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.winners, f, indent=4)
+        os.replace(tmp_path, self.cache_path)
+
+    def get_key(self, q, k, varlen):
+        b, lq, heads, head_dim = q.shape
+        return f"{torch.cuda.get_device_name(q.device)}|{b}|{lq}|{k.shape[1]}|{heads}|{head_dim}|{str(q.dtype)[6:]}{'|varlen' if varlen else ''}"
+
+    def get_mode(self, qkv_list, **kwargs):
+        if self.winners is None:
+            self.load()
+        q, k, v = qkv_list
+        varlen = kwargs.get("q_lens", None) != None or kwargs.get("k_lens", None) != None
+        key = self.get_key(q, k, varlen)
+        mode = self.winners.get(key, None)
+        if mode == None:
+            mode = self.benchmark(q, k, v, **kwargs)
+            self.winners[key] = mode
+            self.save()
+            print(f"Attention autotuning: '{mode}' selected for {key}")
+        return mode
+
+    def benchmark(self, q, k, v, repeats = 3, **kwargs):
+        supported_modes = get_supported_attention_modes()
+        timings = {}
+        for mode in self.candidates:
+            if mode not in supported_modes:
+                continue
+            try:
+                pay_attention([q, k, v], force_attention= mode, **kwargs) # warm up, may compile kernels
+                start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+                start.record()
+                for _ in range(repeats):
+                    pay_attention([q, k, v], force_attention= mode, **kwargs)
+                end.record()
+                end.synchronize()
+                timings[mode] = start.elapsed_time(end)
+            except Exception as e:
+                print(f"Attention autotuning: '{mode}' failed ({e})")
+        return min(timings, key=timings.get) if len(timings) > 0 else "sdpa"
+
+attention_autotuner = AttentionAutotuner(os.path.join("ckpts", "attention_autotune.json"))
 
 @torch.compiler.disable()
 def pay_attention(
@@ -181,6 +260,9 @@ def pay_attention(
         if  attention_mask.dtype == torch.bfloat16 and not bfloat16_supported:
             attention_mask = attention_mask.to(torch.float16)
     attn = offload.shared_state["_attention"] if force_attention== None else force_attention
+    if attn == "autotune":
+        attn = attention_autotuner.get_mode(qkv_list, dropout_p=dropout_p, softmax_scale=softmax_scale, causal=causal, window_size=window_size,
+                                            deterministic=deterministic, version=version, cross_attn=cross_attn, q_lens=q_lens, k_lens=k_lens)
 
     q,k,v = qkv_list
     qkv_list.clear()
@@ -243,10 +325,6 @@ def pay_attention(
 
     if attn=="sage" or attn=="flash":
         if b != 1 :
-            if k_lens == None:
-                k_lens = torch.tensor( [lk] * b, dtype=torch.int32).to(device=q.device, non_blocking=True)
-            if q_lens == None:
-                q_lens = torch.tensor([lq] * b, dtype=torch.int32).to(device=q.device, non_blocking=True)
             k = k.reshape(-1, *k.shape[-2:])
             v = v.reshape(-1, *v.shape[-2:])
             q = q.reshape(-1, *q.shape[-2:])
@@ -256,11 +334,11 @@ def pay_attention(
             szq = q_lens[0].item() if q_lens != None else lq
             szk = k_lens[0].item() if k_lens != None else lk
             if szq != lq or szk != lk:
-                cu_seqlens_q = torch.tensor([0, szq, lq], dtype=torch.int32, device="cuda")
-                cu_seqlens_k = torch.tensor([0, szk, lk], dtype=torch.int32, device="cuda")
+                cu_seqlens_q = get_constant_cu_seqlens((0, szq, lq))
+                cu_seqlens_k = get_constant_cu_seqlens((0, szk, lk))
             else:
-                cu_seqlens_q = torch.tensor([0, lq], dtype=torch.int32, device="cuda")
-                cu_seqlens_k = torch.tensor([0, lk], dtype=torch.int32, device="cuda")
+                cu_seqlens_q = get_constant_cu_seqlens((0, lq))
+                cu_seqlens_k = get_constant_cu_seqlens((0, lk))
             q = q.squeeze(0)
             k = k.squeeze(0)
             v = v.squeeze(0)
@@ -171,6 +171,20 @@ class WanSelfAttention(nn.Module):
         self.o = nn.Linear(dim, dim)
         self.norm_q = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
         self.norm_k = WanRMSNorm(dim, eps=eps) if qk_norm else nn.Identity()
+        # cross attention only: list of (context, k, v, ...) entries or None if the K/V cache is disabled
+        self.kv_cache = None
+
+    def get_cached_kv(self, context):
+        # entries are matched by identity, the model reuses the same context tensors as long as they don't change
+        if self.kv_cache != None:
+            for entry in self.kv_cache:
+                if entry[0] is context:
+                    return entry[1:]
+        return None
+
+    def set_cached_kv(self, context, *kv):
+        if self.kv_cache != None:
+            self.kv_cache.append((context,) + kv)
 
     def forward(self, xlist, grid_sizes, freqs, block_mask = None):
         r"""
@@ -257,13 +271,18 @@ class WanT2VCrossAttention(WanSelfAttention):
         del x
         self.norm_q(q)
         q= q.view(b, -1, n, d)
-        k = self.k(context)
-        self.norm_k(k)
-        k = k.view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        kv = self.get_cached_kv(context)
+        if kv == None:
+            k = self.k(context)
+            self.norm_k(k)
+            k = k.view(b, -1, n, d)
+            v = self.v(context).view(b, -1, n, d)
+            self.set_cached_kv(context, k, v)
+        else:
+            k, v = kv
+        del kv
 
         # compute attention
-        v = v.contiguous().clone()
         qvl_list=[q, k, v]
         del q, k, v
         x = pay_attention(qvl_list,  cross_attn= True)
@@ -302,9 +321,6 @@ class WanI2VCrossAttention(WanSelfAttention):
 
         x = xlist[0]
         xlist.clear()
-
-        context_img = context[:, :257]
-        context = context[:, 257:]
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
@@ -312,10 +328,23 @@ class WanI2VCrossAttention(WanSelfAttention):
         del x
         self.norm_q(q)
         q= q.view(b, -1, n, d)
-        k = self.k(context)
-        self.norm_k(k)
-        k = k.view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        kv = self.get_cached_kv(context)
+        if kv == None:
+            context_img = context[:, :257]
+            context_txt = context[:, 257:]
+            k = self.k(context_txt)
+            self.norm_k(k)
+            k = k.view(b, -1, n, d)
+            v = self.v(context_txt).view(b, -1, n, d)
+            k_img = self.k_img(context_img)
+            self.norm_k_img(k_img)
+            k_img = k_img.view(b, -1, n, d)
+            v_img = self.v_img(context_img).view(b, -1, n, d)
+            del context_img, context_txt
+            self.set_cached_kv(context, k, v, k_img, v_img)
+        else:
+            k, v, k_img, v_img = kv
+        del kv
 
         qkv_list = [q, k, v]
         del k,v
@@ -323,10 +352,6 @@ class WanI2VCrossAttention(WanSelfAttention):
 
         if audio_scale != None:
             audio_x = self.processor(q, audio_proj, grid_sizes[0], audio_context_lens)
-        k_img = self.k_img(context_img)
-        self.norm_k_img(k_img)
-        k_img = k_img.view(b, -1, n, d)
-        v_img = self.v_img(context_img).view(b, -1, n, d)
         qkv_list = [q, k_img, v_img]
         del q, k_img, v_img
         img_x = pay_attention(qkv_list)
@@ -735,6 +760,26 @@ class WanModel(ModelMixin, ConfigMixin):
         self.flag_causal_attention = False
         self.block_mask = None
         self.inject_sample_info = inject_sample_info
+        self.teacache_thresholds = {}
+        self.teacache_deltas = None
+        self.teacache_trace = []
+        self.teacache_buffers = []
+        self.teacache_residual_dtype = None
+        self.enable_fbcache = False
+        self.fbcache_threshold = 0
+        self.fbcache_layers = 1
+        self.fbcache_start_step = 0
+        self.fbcache_buffers = []
+        self.fbcache_first_buffers = []
+        self.fbcache_first_idx = 0
+        self.fbcache_previous_residual = None
+        self.enable_cross_attn_cache = False
+        self.max_text_contexts = 4
+        self.text_contexts = []
+        self.cross_attn_lora_key = None
+        self.fbcache_should_calc = True
+        self.fbcache_skipped_steps = 0
+        self.fbcache_trace = []
 
         # embeddings
         self.patch_embedding = nn.Conv3d(
@@ -851,51 +896,150 @@ class WanModel(ModelMixin, ConfigMixin):
         self._lock_dtype = dtype
 
 
-    def compute_teacache_threshold(self, start_step, timesteps = None, speed_factor =0): 
+    def compute_teacache_deltas(self, timesteps):
+        # rescaled relative L1 distance between the time embeddings of consecutive steps, all the embeddings being
+        # computed in a single batch and the distances transferred with a single sync
         modulation_dtype = self.time_projection[1].weight.dtype
-        rescale_func = np.poly1d(self.coefficients)
-        e_list = []
-        for t in timesteps:
-            t = torch.stack([t])
-            time_emb =  self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, t.flatten()).to(modulation_dtype) )  # b, dim   
-            e_list.append(time_emb)
-        best_deltas = None
-        best_threshold = 0.01
-        best_diff = 1000
-        best_signed_diff = 1000
-        target_nb_steps= int(len(timesteps) / speed_factor)
-        threshold = 0.01
-        while threshold <= 0.6:
-            accumulated_rel_l1_distance =0
-            nb_steps = 0
-            diff = 1000
-            deltas = []
-            for i, t in enumerate(timesteps):
-                skip = False    
-                if not (i<=start_step or i== len(timesteps)-1):
-                    delta = abs(rescale_func(((e_list[i]-e_list[i-1]).abs().mean() / e_list[i-1].abs().mean()).cpu().item()))
-                    # deltas.append(delta)
-                    accumulated_rel_l1_distance += delta
-                    if accumulated_rel_l1_distance < threshold:
-                        skip = True
-                        # deltas.append("SKIP")
-                    else:
+        lengths = [t.numel() for t in timesteps]
+        t_flat = torch.cat([t.flatten() for t in timesteps])
+        e_flat = self.time_embedding( sinusoidal_embedding_1d(self.freq_dim, t_flat).to(modulation_dtype) )
+        if len(set(lengths)) == 1:
+            e_all = e_flat.view(len(timesteps), -1)
+            rel_l1 = (e_all[1:] - e_all[:-1]).abs().mean(1) / e_all[:-1].abs().mean(1)
+        else:
+            e_list = e_flat.split(lengths)
+            rel_l1 = torch.stack([ (e_list[i] - e_list[i-1]).abs().mean() / e_list[i-1].abs().mean() for i in range(1, len(e_list)) ])
+        return np.abs(np.polyval(self.coefficients, rel_l1.float().cpu().numpy()))
+
+    def get_teacache_buffer(self, i, x):
+        return self.get_cache_buffer(self.teacache_buffers, i, x)
+
+    def get_cache_buffer(self, buffers, i, x):
+        # Residual arena: one buffer per branch sized for the current sequence, that is reused across steps and sliding
+        # windows and only reallocated when the shape changes. It may be stored in a lower precision (bf16 / fp16)
+        dtype = x.dtype if self.teacache_residual_dtype == None else self.teacache_residual_dtype
+        while len(buffers) <= i:
+            buffers.append(None)
+        buffer = buffers[i]
+        if buffer is None or buffer.shape != x.shape or buffer.dtype != dtype or buffer.device != x.device:
+            buffers[i] = buffer = None
+            buffers[i] = buffer = torch.empty(x.shape, dtype=dtype, device=x.device)
+        return buffer
+
+    def release_teacache_buffers(self):
+        self.teacache_buffers = []
+        self.previous_residual = None
+        self.fbcache_buffers = []
+        self.fbcache_first_buffers = []
+        self.fbcache_previous_residual = None
+        self.release_cross_attn_cache()
+
+    def get_lora_key(self):
+        # active LoRAs with their multiplier for the current step
+        active_adapters = getattr(self, "_loras_active_adapters", None)
+        if not active_adapters:
+            return None
+        loras_scaling = getattr(self, "_loras_scaling", None) or {}
+        step_no = getattr(self, "_lora_step_no", 0)
+        key = []
+        for adapter in active_adapters:
+            multiplier = loras_scaling.get(adapter, 1.)
+            if isinstance(multiplier, list):
+                multiplier = multiplier[min(step_no, len(multiplier) - 1)]
+            key.append((adapter, float(multiplier)))
+        return tuple(key)
+
+    def release_cross_attn_cache(self):
+        self.text_contexts = []
+        blocks = list(self.blocks) + list(getattr(self, "vace_blocks", []))
+        for block in blocks:
+            block.cross_attn.kv_cache = [] if self.enable_cross_attn_cache else None
+
+    def get_text_context(self, u, clip_fea):
+        # the embedded contexts are kept as long as the pipeline passes the same text (and clip) tensors,
+        # so that the cross attention modules can reuse the K/V they have projected at the first step
+        for entry in self.text_contexts:
+            if entry[0] is u and entry[1] is clip_fea:
+                return entry[2]
+        context = self.text_embedding( torch.cat( [u, u.new_zeros(self.text_len - u.size(0), u.size(1))] ).unsqueeze(0) )
+        if clip_fea is not None:
+            context = torch.cat( [self.img_emb(clip_fea), context ], dim=1 )  # bs x (257 + text_len) x dim
+        if self.enable_cross_attn_cache:
+            if len(self.text_contexts) >= self.max_text_contexts:
+                self.release_cross_attn_cache()
+            self.text_contexts.append((u, clip_fea, context))
+        return context
+
+    def check_fbcache(self, current_step, first_residual):
+        # First Block Cache: the residual of the first blocks is compared with the one of the last fully computed step,
+        # the remaining blocks are skipped (and their cached residual reused) when the relative L1 distance is small
+        previous = self.fbcache_previous_residual
+        rel_l1 = None
+        if previous is None or previous.shape != first_residual.shape or current_step <= self.fbcache_start_step or current_step == self.num_steps-1:
+            should_calc = True
+        else:
+            rel_l1 = ((first_residual - previous).abs().mean() / previous.abs().mean()).item()
+            should_calc = rel_l1 >= self.fbcache_threshold
+        if should_calc:
+            self.fbcache_previous_residual = first_residual
+            self.fbcache_first_idx = 1 - self.fbcache_first_idx
+        else:
+            self.fbcache_skipped_steps += 1
+        self.fbcache_trace.append((current_step, rel_l1, not should_calc))
+        return should_calc
+
+    def get_teacache_delta(self, current_step, e):
+        # The time embeddings only depend on the timesteps, so the deltas of the whole schedule have already been
+        # computed with the threshold and the skip decision doesn't need to wait for the device. Otherwise the
+        # rescale polynomial is evaluated on the device and only its result is synced.
+        deltas = self.teacache_deltas
+        if deltas != None and current_step < len(deltas):
+            return deltas[current_step]
+        prev = self.previous_modulated_input
+        rel_l1 = ((e - prev).abs().mean() / prev.abs().mean()).float()
+        delta = torch.zeros_like(rel_l1)
+        for coefficient in self.coefficients:
+            delta = delta * rel_l1 + coefficient
+        return delta.abs().item()
+
+    def compute_teacache_threshold(self, start_step, timesteps = None, speed_factor =0): 
+        key = (tuple(self.coefficients), tuple(torch.cat([t.flatten() for t in timesteps]).tolist()), start_step, speed_factor)
+        cached = self.teacache_thresholds.get(key, None)
+        if cached == None:
+            with torch.no_grad():
+                deltas = [0] + self.compute_teacache_deltas(timesteps).tolist()
+            self.teacache_deltas = deltas
+            nb_timesteps = len(timesteps)
+            best_threshold = 0.01
+            best_diff = 1000
+            best_signed_diff = 1000
+            target_nb_steps= int(nb_timesteps / speed_factor)
+            threshold = 0.01
+            while threshold <= 0.6:
+                accumulated_rel_l1_distance =0
+                nb_steps = 0
+                for i in range(nb_timesteps):
+                    if not (i<=start_step or i== nb_timesteps-1):
+                        accumulated_rel_l1_distance += deltas[i]
+                        if accumulated_rel_l1_distance < threshold:
+                            continue
                         accumulated_rel_l1_distance = 0
-                if not skip:
                     nb_steps += 1
-                    signed_diff = target_nb_steps - nb_steps               
-                    diff = abs(signed_diff)  
-            if diff < best_diff:
-                best_threshold = threshold
-                best_deltas = deltas
-                best_diff = diff
-                best_signed_diff = signed_diff
-            elif diff > best_diff:
-                break
-            threshold += 0.01
+                signed_diff = target_nb_steps - nb_steps               
+                diff = abs(signed_diff)  
+                if diff < best_diff:
+                    best_threshold = threshold
+                    best_diff = diff
+                    best_signed_diff = signed_diff
+                elif diff > best_diff:
+                    break
+                threshold += 0.01
+            cached = (best_threshold, nb_timesteps/(target_nb_steps - best_signed_diff), deltas)
+            self.teacache_thresholds[key] = cached
+        best_threshold, gain, self.teacache_deltas = cached
         self.rel_l1_thresh = best_threshold
-        print(f"Tea Cache, best threshold found:{best_threshold:0.2f} with gain x{len(timesteps)/(target_nb_steps - best_signed_diff):0.2f} for a target of x{speed_factor}")
-        # print(f"deltas:{best_deltas}")
+        self.teacache_trace = []
+        print(f"Tea Cache, best threshold found:{best_threshold:0.2f} with gain x{gain:0.2f} for a target of x{speed_factor}")
         return best_threshold
 
     
@@ -938,11 +1082,9 @@ class WanModel(ModelMixin, ConfigMixin):
         x_list = x
         joint_pass = len(x_list) > 1
         is_source_x = [ x.data_ptr() == x_list[0].data_ptr() and i > 0 for i, x in enumerate(x_list) ]
-        last_x_idx  = 0
         for i, (is_source, x) in enumerate(zip(is_source_x, x_list)):
             if is_source:
                 x_list[i] = x_list[0].clone()
-                last_x_idx = i
             else:
                 # image source                
                 if y is not None:
@@ -991,11 +1133,13 @@ class WanModel(ModelMixin, ConfigMixin):
                 e0 = e0 + self.fps_projection(fps_emb).unflatten(1, (6, self.dim))
 
         # context
-        context = [self.text_embedding( torch.cat( [u, u.new_zeros(self.text_len - u.size(0), u.size(1))] ).unsqueeze(0) ) for u in context  ] 
-        
-        if clip_fea is not None:
-            context_clip = self.img_emb(clip_fea)  # bs x 257 x dim
-            context = [ torch.cat( [context_clip, u ], dim=1 ) for u in context  ] 
+        if self.enable_cross_attn_cache:
+            # the cached K/V are only valid for the LoRA multipliers they have been computed with
+            lora_key = self.get_lora_key()
+            if lora_key != self.cross_attn_lora_key or self.blocks[0].cross_attn.kv_cache == None:
+                self.cross_attn_lora_key = lora_key
+                self.release_cross_attn_cache()
+        context = [self.get_text_context(u, clip_fea) for u in context]
 
         context_list = context
         if audio_scale != None: 
@@ -1031,12 +1175,12 @@ class WanModel(ModelMixin, ConfigMixin):
             if x_id != 0:
                 should_calc = self.should_calc
             else:
+                delta = None
                 if current_step <= self.teacache_start_step or current_step == self.num_steps-1:
                     should_calc = True
                     self.accumulated_rel_l1_distance = 0
                 else:
-                    rescale_func = np.poly1d(self.coefficients)
-                    delta = abs(rescale_func(((e-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item()))
+                    delta = self.get_teacache_delta(current_step, e)
                     self.accumulated_rel_l1_distance += delta
                     if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
                         should_calc = False
@@ -1045,6 +1189,8 @@ class WanModel(ModelMixin, ConfigMixin):
                     else:
                         should_calc = True
                         self.accumulated_rel_l1_distance = 0
+                # per step trace (step no, delta, accumulated distance, skipped) to help tuning the thresholds
+                self.teacache_trace.append((current_step, delta, self.accumulated_rel_l1_distance, not should_calc))
                 self.previous_modulated_input = e 
                 self.should_calc = should_calc                        
 
@@ -1058,14 +1204,22 @@ class WanModel(ModelMixin, ConfigMixin):
             x = None
         else:
             if self.enable_teacache:
+                # the inputs are saved in the residual buffers, which are turned in place into residuals after the blocks,
+                # branches that share the same source input as branch 0 get their residual computed from its buffer
                 if joint_pass:
-                    self.previous_residual = [ None ] * len(self.previous_residual)
+                    for i, (x, is_source) in enumerate(zip(x_list, is_source_x)):
+                        self.previous_residual[i] = self.get_teacache_buffer(i, x)
+                        if not is_source:
+                            self.previous_residual[i].copy_(x)
                 else:
-                    self.previous_residual[x_id] = None
-                ori_hidden_states = [ None ] * len(x_list)
-                ori_hidden_states[0] = x_list[0].clone()
-                for i in range(1, len(x_list)):
-                    ori_hidden_states[i] = ori_hidden_states[0] if is_source_x[i] else x_list[i].clone()  
+                    self.previous_residual[x_id] = self.get_teacache_buffer(x_id, x_list[0]).copy_(x_list[0])
+                x = None
+
+            fbcache_input = None
+            fbcache_computed = False
+            if self.enable_fbcache and (joint_pass or x_id == 0):
+                # the input of the first blocks is turned in place into their residual
+                fbcache_input = self.get_cache_buffer(self.fbcache_first_buffers, self.fbcache_first_idx, x_list[0]).copy_(x_list[0])
             
             for block_idx, block in enumerate(self.blocks):
                 offload.shared_state["layer"] = block_idx
@@ -1074,6 +1228,21 @@ class WanModel(ModelMixin, ConfigMixin):
                 if pipeline._interrupt:
                     return [None] * len(x_list)
 
+                if self.enable_fbcache and block_idx == self.fbcache_layers:
+                    if fbcache_input is not None:
+                        self.fbcache_should_calc = self.check_fbcache(current_step, torch.sub(x_list[0], fbcache_input, out=fbcache_input))
+                        fbcache_input = None
+                    if not self.fbcache_should_calc:
+                        for i, x in enumerate(x_list):
+                            x += self.fbcache_buffers[i if joint_pass else x_id]
+                        x = None
+                        break
+                    # the outputs of the first blocks are saved to be turned in place into the residual of the remaining blocks
+                    for i, x in enumerate(x_list):
+                        self.get_cache_buffer(self.fbcache_buffers, i if joint_pass else x_id, x).copy_(x)
+                    x = None
+                    fbcache_computed = True
+
                 if (x_id != 0 or joint_pass) and slg_layers is not None and block_idx in slg_layers:
                     if not joint_pass:
                         continue
@@ -1084,21 +1253,22 @@ class WanModel(ModelMixin, ConfigMixin):
                         del x
                     del context, hints
 
+            if fbcache_computed:
+                for i, x in enumerate(x_list):
+                    residual = self.fbcache_buffers[i if joint_pass else x_id]
+                    torch.sub(x, residual, out=residual)
+                x, residual = None, None
+
             if self.enable_teacache:
                 if joint_pass:
-                    for i, (x, ori, is_source) in enumerate(zip(x_list, ori_hidden_states, is_source_x)) :
-                        if i == 0 or is_source and i != last_x_idx  :
-                            self.previous_residual[i] = torch.sub(x, ori) 
-                        else:
-                            self.previous_residual[i] = ori
-                            torch.sub(x, ori, out=self.previous_residual[i]) 
-                        ori_hidden_states[i] = None
-                        x , ori = None, None
+                    for i, is_source in enumerate(is_source_x):
+                        if is_source:
+                            torch.sub(x_list[i], self.previous_residual[0], out=self.previous_residual[i])
+                    for i, is_source in enumerate(is_source_x):
+                        if not is_source:
+                            torch.sub(x_list[i], self.previous_residual[i], out=self.previous_residual[i])
                 else:
-                    residual = ori_hidden_states[0] # just to have a readable code
-                    torch.sub(x_list[0], ori_hidden_states[0], out=residual)
-                    self.previous_residual[x_id] = residual
-                residual, ori_hidden_states = None, None
+                    torch.sub(x_list[0], self.previous_residual[x_id], out=self.previous_residual[x_id])
 
         for i, x in enumerate(x_list):
             # head
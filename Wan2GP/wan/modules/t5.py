@@ -1,7 +1,10 @@
 # Modified from transformers.models.t5.modeling_t5
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
 import logging
 import math
+import os
+from collections import OrderedDict
 
 import torch
 import torch.nn as nn
@@ -14,6 +17,8 @@ __all__ = [
     'T5Encoder',
     'T5Decoder',
     'T5EncoderModel',
+    'TextEmbeddingsCache',
+    'text_embeddings_cache',
 ]
 
 
@@ -469,6 +474,61 @@ def umt5_xxl(**kwargs):
     return _t5('umt5-xxl', **cfg)
 
 
+class TextEmbeddingsCache:
+    """
+    LRU cache of prompt embeddings shared by all the T5EncoderModel instances, so that it survives model switches.
+    Entries are keyed by (encoder checkpoint, dtype, text length, text) and kept on the CPU, with an optional
+    write-through copy on disk (cache_dir) that is looked up on memory misses.
+    """
+
+    def __init__(self, max_entries=64, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+
+    def _get_disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pt')
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        value = self.entries.get(key, None)
+        if value is not None:
+            self.entries.move_to_end(key)
+            return value
+        if self.cache_dir:
+            path = self._get_disk_path(key)
+            if os.path.isfile(path):
+                try:
+                    value = torch.load(path, map_location='cpu', weights_only=True)
+                except Exception as e:
+                    logging.warning(f'unable to read cached text embedding {path}: {e}')
+                    return None
+                self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        value = value.to('cpu')
+        self._store(key, value)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            torch.save(value, self._get_disk_path(key))
+
+    def clear(self):
+        self.entries.clear()
+
+
+text_embeddings_cache = TextEmbeddingsCache()
+
+
 class T5EncoderModel:
 
     def __init__(
@@ -509,10 +569,18 @@ class T5EncoderModel:
             name=tokenizer_path, seq_len=text_len, clean='whitespace')
 
     def __call__(self, texts, device):
-        ids, mask = self.tokenizer(
-            texts, return_mask=True, add_special_tokens=True)
-        ids = ids.to(device)
-        mask = mask.to(device)
-        seq_lens = mask.gt(0).sum(dim=1).long()
-        context = self.model(ids, mask)
-        return [u[:v] for u, v in zip(context, seq_lens)]
+        # the encoder is only run (and therefore only swapped in by the offloader) for texts that are not already cached
+        keys = [(self.checkpoint_path, str(self.dtype), self.text_len, text) for text in texts]
+        contexts = [text_embeddings_cache.get(key) for key in keys]
+        missing = [i for i, context in enumerate(contexts) if context is None]
+        if len(missing) > 0:
+            ids, mask = self.tokenizer(
+                [texts[i] for i in missing], return_mask=True, add_special_tokens=True)
+            ids = ids.to(device)
+            mask = mask.to(device)
+            seq_lens = mask.gt(0).sum(dim=1).long()
+            context = self.model(ids, mask)
+            for i, u, v in zip(missing, context, seq_lens):
+                contexts[i] = u[:v]
+                text_embeddings_cache.put(keys[i], contexts[i])
+        return [u.to(device, copy=True) for u in contexts]
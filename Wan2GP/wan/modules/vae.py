@@ -1,5 +1,7 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import json
 import logging
+import os
 from mmgp import offload
 import torch
 import torch.cuda.amp as amp
@@ -14,6 +16,80 @@ __all__ = [
 CACHE_T = 2
 
 
+class VAETilePlanner:
+    """
+    Chooses the VAE tile size from a memory model of the decoder instead of fixed thresholds on the device capacity.
+    The model (fixed cost + cost per decoded pixel) is measured once per device / dtype by decoding two small latents
+    and stored in a json file, the largest tile (or no tiling) whose estimated peak fits in the free VRAM is then picked.
+    """
+    tile_sizes = [0, 512, 384, 256, 192, 128]
+
+    def __init__(self, profile_path):
+        self.profile_path = profile_path
+        self.profiles = None
+
+    def _get_key(self, dtype):
+        return f"{torch.cuda.get_device_name()}|{dtype}"
+
+    def get_profile(self, dtype):
+        if not torch.cuda.is_available():
+            return None
+        if self.profiles is None:
+            self.profiles = {}
+            if os.path.isfile(self.profile_path):
+                try:
+                    with open(self.profile_path, "r", encoding="utf-8") as reader:
+                        self.profiles = json.load(reader)
+                except Exception as e:
+                    logging.warning(f"unable to read VAE memory profile {self.profile_path}: {e}")
+        return self.profiles.get(self._get_key(dtype), None)
+
+    @torch.no_grad()
+    def calibrate(self, model, dtype, device):
+        profile = self.get_profile(dtype)
+        if profile is not None:
+            return profile
+        measures = []
+        for size in (16, 32):
+            z = torch.zeros((1, model.z_dim, 2, size, size), dtype=dtype, device=device)
+            model.decode(z) # first call loads the weights and warms up the kernels
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            base_memory = torch.cuda.memory_allocated()
+            model.decode(z)
+            torch.cuda.synchronize()
+            measures.append(((size * 8) ** 2, torch.cuda.max_memory_allocated() - base_memory))
+        (pixels1, memory1), (pixels2, memory2) = measures
+        per_pixel = max((memory2 - memory1) / (pixels2 - pixels1), 1)
+        profile = {"fixed": max(memory1 - per_pixel * pixels1, 0), "per_pixel": per_pixel}
+        self.profiles[self._get_key(dtype)] = profile
+        try:
+            os.makedirs(os.path.dirname(self.profile_path) or ".", exist_ok=True)
+            with open(self.profile_path, "w", encoding="utf-8") as writer:
+                json.dump(self.profiles, writer, indent=4)
+        except Exception as e:
+            logging.warning(f"unable to save VAE memory profile {self.profile_path}: {e}")
+        return profile
+
+    def plan(self, model, dtype, device, frames, height, width):
+        # frames, height, width are in sample space, returns (tile_size, estimated_peak, free_memory)
+        profile = self.calibrate(model, dtype, device)
+        free_memory = torch.cuda.mem_get_info()[0] + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        # decoded chunks + their concatenation + the float32 copy returned to the caller
+        output_bytes = 3 * frames * height * width * (2 * dtype.itemsize + 4)
+        for tile_size in self.tile_sizes:
+            if tile_size > 0 and tile_size >= max(height, width):
+                continue
+            tile_pixels = height * width if tile_size == 0 else min(tile_size, height) * min(tile_size, width)
+            peak = profile["fixed"] + profile["per_pixel"] * tile_pixels + output_bytes
+            if peak < 0.9 * free_memory:
+                break
+        return tile_size, peak, free_memory
+
+
+vae_tile_planner = VAETilePlanner(os.path.join("ckpts", "vae_memory_profile.json"))
+
+
 class CausalConv3d(nn.Conv3d):
     """
     Causal 3d convolusion.
@@ -575,52 +651,131 @@ class WanVAE_(nn.Module):
         return mu
 
 
-    def decode(self, z, scale=None, any_end_frame = False):
-        self.clear_cache()
+    def scale_latents(self, z, scale):
         # z: [b,c,t,h,w]
-        if scale != None:
-            if isinstance(scale[0], torch.Tensor):
-                z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
-                    1, self.z_dim, 1, 1, 1)
-            else:
-                z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
-        x = self.conv2(z)
+        if isinstance(scale[0], torch.Tensor):
+            return z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
+                1, self.z_dim, 1, 1, 1)
+        else:
+            return z / scale[1] + scale[0]
+
+    def decode_frames(self, x, start, iter_, any_end_frame = False):
+        # x: latent frames [start, start + x.shape[2]) of a clip of iter_ latent frames, already projected by conv2.
+        # The causal cache self._feat_map is updated in place, so consecutive calls decode the clip chunk by chunk
         out_list = []
-        for i in range(iter_):
+        for k in range(x.shape[2]):
+            i = start + k
             self._conv_idx = [0]
-            if i == 0:
-                out_list.append(self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx))
-            elif any_end_frame and i==iter_-1:
+            if any_end_frame and i == iter_ - 1 and i > 0:
                 out_list.append(self.decoder(
-                    x[:, :, -1:, :, :],
+                    x[:, :, k:k + 1, :, :],
                     feat_cache=None ,
                     feat_idx=self._conv_idx))
             else:
                 out_list.append(self.decoder(
-                    x[:, :, i:i + 1, :, :],
+                    x[:, :, k:k + 1, :, :],
                     feat_cache=self._feat_map,
                     feat_idx=self._conv_idx))
+        return torch.cat(out_list, 2)
+
+    def decode(self, z, scale=None, any_end_frame = False):
+        self.clear_cache()
+        # z: [b,c,t,h,w]
+        if scale != None:
+            z = self.scale_latents(z, scale)
+        iter_ = z.shape[2]
+        x = self.conv2(z)
+        out = self.decode_frames(x, 0, iter_, any_end_frame)
         self.clear_cache()
-        out = torch.cat(out_list, 2)
         return out
-    
+
+    def decode_stream(self, z, scale=None, any_end_frame = False, chunk_size = 4):
+        # generator version of decode that yields the decoded frames of chunk_size latent frames at a time,
+        # the causal cache being carried over from one chunk to the next
+        self.clear_cache()
+        if scale != None:
+            z = self.scale_latents(z, scale)
+        iter_ = z.shape[2]
+        try:
+            for start in range(0, iter_, chunk_size):
+                yield self.decode_frames(self.conv2(z[:, :, start:start + chunk_size]), start, iter_, any_end_frame)
+        finally:
+            self.clear_cache()
+
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[:, :, :, y, :] * (y / blend_extent)
+        if blend_extent > 0:
+            ramp = torch.arange(blend_extent, device=b.device, dtype=b.dtype).div_(blend_extent).view(-1, 1)
+            b[:, :, :, :blend_extent, :].mul_(ramp).add_(a[:, :, :, a.shape[-2] - blend_extent:, :] * (1 - ramp))
         return b
 
     def blend_h(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
         blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (x / blend_extent)
+        if blend_extent > 0:
+            ramp = torch.arange(blend_extent, device=b.device, dtype=b.dtype).div_(blend_extent)
+            b[:, :, :, :, :blend_extent].mul_(ramp).add_(a[:, :, :, :, a.shape[-1] - blend_extent:] * (1 - ramp))
         return b
-    
-    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False):
+
+    def get_tiles_batch_size(self, tile_size, frames):
+        # number of tiles that can be processed in a single call with the VRAM currently free, decoding a sample pixel
+        # of one frame costs roughly the activations of the 96 channels full resolution stage + the output accumulation
+        if not torch.cuda.is_available():
+            return 1
+        free_memory, _ = torch.cuda.mem_get_info()
+        dtype = getattr(self, "_model_dtype", torch.float32)
+        profile = vae_tile_planner.get_profile(dtype)
+        if profile is not None:
+            bytes_per_pixel = profile["per_pixel"] + 2 * 3 * frames * dtype.itemsize
+        else:
+            bytes_per_pixel = (96 * 4 * 6 + 2 * 3 * frames) * dtype.itemsize
+        return max(1, int(0.8 * free_memory // (bytes_per_pixel * tile_size * tile_size)))
+
+    def _process_tiles(self, x, process, tile_size, overlap_size, blend_extent, row_limit, out_scale, max_tiles, output_device=None):
+        # Split x into overlapping tiles, tiles of the same shape are processed together (up to max_tiles per call).
+        # Each row is blended in place with the bottom strip of the previous row and with its left neighbours, then its
+        # crops are written into a preallocated output, so only one row of processed tiles is alive at any time.
+        positions_h = list(range(0, x.shape[-2], overlap_size))
+        positions_w = list(range(0, x.shape[-1], overlap_size))
+        def out_length(size, positions):
+            return sum(min(row_limit, int(min(tile_size, size - pos) * out_scale)) for pos in positions)
+        out_h, out_w = out_length(x.shape[-2], positions_h), out_length(x.shape[-1], positions_w)
+
+        output = None
+        previous_strips = None
+        out_i = 0
+        for i in positions_h:
+            tiles = [x[:, :, :, i: i + tile_size, j: j + tile_size] for j in positions_w]
+            row = [None] * len(tiles)
+            groups = {}
+            for j, tile in enumerate(tiles):
+                groups.setdefault(tuple(tile.shape), []).append(j)
+            for indexes in groups.values():
+                for k in range(0, len(indexes), max_tiles):
+                    batch = indexes[k:k + max_tiles]
+                    processed = process(torch.cat([tiles[j] for j in batch]))
+                    for j, tile in zip(batch, processed.split(x.shape[0])):
+                        row[j] = tile
+            tiles = processed = None
+
+            if output is None:
+                output = torch.empty(row[0].shape[:3] + (out_h, out_w), dtype=row[0].dtype, device=x.device if output_device is None else output_device)
+            out_j = 0
+            for j, tile in enumerate(row):
+                # blend the above tile and the left tile
+                # to the current tile and add the current tile to the result row
+                if previous_strips is not None:
+                    self.blend_v(previous_strips[j], tile, blend_extent)
+                if j > 0:
+                    self.blend_h(row[j - 1], tile, blend_extent)
+                crop = tile[:, :, :, :row_limit, :row_limit]
+                output[:, :, :, out_i: out_i + crop.shape[-2], out_j: out_j + crop.shape[-1]] = crop
+                out_j += crop.shape[-1]
+            out_i += crop.shape[-2]
+            previous_strips = [tile[:, :, :, -blend_extent:, :].clone() for tile in row]
+            row = None
+        return output
+
+    def spatial_tiled_decode(self, z, scale, tile_size, any_end_frame= False, max_tiles = None, output_device = None):
         tile_sample_min_size = tile_size
         tile_latent_min_size = int(tile_sample_min_size / 8)
         tile_overlap_factor = 0.25
@@ -638,33 +793,12 @@ class WanVAE_(nn.Module):
         blend_extent = int(tile_sample_min_size * tile_overlap_factor) #256 0.25
         row_limit = tile_sample_min_size - blend_extent
 
-        # Split z into overlapping tiles and decode them separately.
-        # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], overlap_size):
-            row = []
-            for j in range(0, z.shape[-1], overlap_size):
-                tile = z[:, :, :, i: i + tile_latent_min_size, j: j + tile_latent_min_size]
-                decoded = self.decode(tile, any_end_frame= any_end_frame)
-                row.append(decoded)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        return torch.cat(result_rows, dim=-2)
+        if max_tiles is None:
+            max_tiles = self.get_tiles_batch_size(tile_sample_min_size, 1 + 4 * (z.shape[2] - 1))
 
+        return self._process_tiles(z, lambda tile: self.decode(tile, any_end_frame= any_end_frame), tile_latent_min_size, overlap_size, blend_extent, row_limit, 8, max_tiles, output_device)
 
-    def spatial_tiled_encode(self, x, scale, tile_size, any_end_frame = False) :
+    def spatial_tiled_encode(self, x, scale, tile_size, any_end_frame = False, max_tiles = None) :
         tile_sample_min_size = tile_size
         tile_latent_min_size = int(tile_sample_min_size / 8)
         tile_overlap_factor = 0.25
@@ -673,29 +807,10 @@ class WanVAE_(nn.Module):
         blend_extent = int(tile_latent_min_size * tile_overlap_factor)
         row_limit = tile_latent_min_size - blend_extent
 
-        # Split video into tiles and encode them separately.
-        rows = []
-        for i in range(0, x.shape[-2], overlap_size):
-            row = []
-            for j in range(0, x.shape[-1], overlap_size):
-                tile = x[:, :, :, i: i + tile_sample_min_size, j: j + tile_sample_min_size]
-                tile = self.encode(tile, any_end_frame= any_end_frame)
-                row.append(tile)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
+        if max_tiles is None:
+            max_tiles = self.get_tiles_batch_size(tile_sample_min_size, x.shape[2])
 
-        mu = torch.cat(result_rows, dim=-2)
+        mu = self._process_tiles(x, lambda tile: self.encode(tile, any_end_frame= any_end_frame), tile_sample_min_size, overlap_size, blend_extent, row_limit, 1 / 8, max_tiles)
 
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -788,16 +903,9 @@ class WanVAE:
 
     @staticmethod
     def get_VAE_tile_size(vae_config, device_mem_capacity, mixed_precision):
-        # VAE Tiling
+        # VAE Tiling, in auto mode (-1) the tile size is planned at encode / decode time from the shape and the free VRAM
         if vae_config == 0:
-            if mixed_precision:
-                device_mem_capacity = device_mem_capacity / 2
-            if device_mem_capacity >= 24000:
-                use_vae_config = 1            
-            elif device_mem_capacity >= 8000:
-                use_vae_config = 2
-            else:          
-                use_vae_config = 3
+            return -1
         else:
             use_vae_config = vae_config
 
@@ -810,20 +918,61 @@ class WanVAE:
 
         return  VAE_tile_size
 
+    def plan_tile_size(self, frames, height, width):
+        if not torch.cuda.is_available():
+            return 256
+        tile_size, peak, free_memory = vae_tile_planner.plan(self.model, self.dtype, self.device, frames, height, width)
+        tiling = "no tiling" if tile_size == 0 else f"tiles of {tile_size}px"
+        print(f"VAE plan: {tiling} for {frames} frames of {width}x{height}, estimated peak {peak / 1073741824:.1f} GB / {free_memory / 1073741824:.1f} GB free")
+        return tile_size
+
     def encode(self, videos, tile_size = 256, any_end_frame = False):
         """
         videos: A list of videos each with shape [C, T, H, W].
         """
         original_dtype = videos[0].dtype
-        
-        if tile_size > 0:
-            return [ self.model.spatial_tiled_encode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame).float().squeeze(0) for u in videos ]
-        else:
-            return [ self.model.encode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).float().squeeze(0) for u in videos ]
+        results = []
+        for u in videos:
+            u_tile_size = tile_size if tile_size >= 0 else self.plan_tile_size(*u.shape[1:])
+            if u_tile_size > 0:
+                results.append(self.model.spatial_tiled_encode(u.to(self.dtype).unsqueeze(0), self.scale, u_tile_size, any_end_frame=any_end_frame).float().squeeze(0))
+            else:
+                results.append(self.model.encode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).float().squeeze(0))
+        return results
 
 
-    def decode(self, zs, tile_size, any_end_frame = False):
-        if tile_size > 0:
-            return [ self.model.spatial_tiled_decode(u.to(self.dtype).unsqueeze(0), self.scale, tile_size, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
-        else:
-            return [ self.model.decode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0) for u in zs ]
+    def decode(self, zs, tile_size, any_end_frame = False, output_device = None, chunk_size = 4):
+        """
+        zs: A list of latents each with shape [C, T, H, W].
+        With an output_device (for instance "cpu") the videos are written as they are produced into a preallocated tensor
+        on this device, so the device never holds a whole decoded video: untiled videos are decoded chunk by chunk and
+        tiled videos tile by tile (the causal cache of a tile is released before the next one is decoded).
+        """
+        results = []
+        for u in zs:
+            u_tile_size = tile_size if tile_size >= 0 else self.plan_tile_size(1 + 4 * (u.shape[1] - 1), u.shape[2] * 8, u.shape[3] * 8)
+            if output_device != None and u_tile_size == 0:
+                output = None
+                pos = 0
+                for chunk in self.decode_stream(u, any_end_frame=any_end_frame, chunk_size=chunk_size):
+                    if output is None:
+                        frames = 1 + 4 * (u.shape[1] - 1)
+                        output = torch.empty((chunk.shape[0], frames) + chunk.shape[2:], dtype=torch.float32, device=output_device)
+                    output[:, pos:pos + chunk.shape[1]] = chunk
+                    pos += chunk.shape[1]
+                    del chunk
+                results.append(output[:, :pos])
+            elif u_tile_size > 0:
+                results.append(self.model.spatial_tiled_decode(u.to(self.dtype).unsqueeze(0), self.scale, u_tile_size, any_end_frame=any_end_frame, output_device=output_device).clamp_(-1, 1).float().squeeze(0))
+            else:
+                results.append(self.model.decode(u.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame).clamp_(-1, 1).float().squeeze(0))
+        return results
+
+    def decode_stream(self, z, any_end_frame = False, chunk_size = 4):
+        """
+        Decodes without tiling a single latent [C, T, H, W] chunk_size latent frames at a time and yields the decoded
+        [C, t, H, W] chunks, the causal cache of the decoder being kept from one chunk to the next.
+        """
+        chunks = self.model.decode_stream(z.to(self.dtype).unsqueeze(0), self.scale, any_end_frame=any_end_frame, chunk_size=chunk_size)
+        for chunk in chunks:
+            yield chunk.clamp_(-1, 1).float().squeeze(0)
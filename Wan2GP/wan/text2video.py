@@ -249,7 +249,7 @@ class WanT2V:
                         src_ref_images[i][j] = ref_img.to(device)
         return src_video, src_mask, src_ref_images
 
-    def decode_latent(self, zs, ref_images=None, tile_size= 0 ):
+    def decode_latent(self, zs, ref_images=None, tile_size= 0, output_device = None):
         if ref_images is None:
             ref_images = [None] * len(zs)
         else:
@@ -261,7 +261,7 @@ class WanT2V:
                 z = z[:, len(refs):, :, :]
             trimed_zs.append(z)
 
-        return self.vae.decode(trimed_zs, tile_size= tile_size)
+        return self.vae.decode(trimed_zs, tile_size= tile_size, output_device= output_device)
 
     def get_vae_latents(self, ref_images, device, tile_size= 0):
         ref_vae_latents = []
@@ -581,10 +581,10 @@ class WanT2V:
             if phantom:
                 # phantom post processing
                 x0 = [x0_[:,:-input_ref_images.shape[1]] for x0_ in x0]
-            videos = self.vae.decode(x0, VAE_tile_size)
+            videos = self.vae.decode(x0, VAE_tile_size, output_device= "cpu")
         else:
             # vace post processing
-            videos = self.decode_latent(x0, input_ref_images, VAE_tile_size)
+            videos = self.decode_latent(x0, input_ref_images, VAE_tile_size, output_device= "cpu")
         if return_latent_slice != None:
             return { "x" : videos[0], "latent_slice" : latent_slice }
         return videos[0]
@@ -798,3 +798,121 @@ class FlowUniPCMultistepScheduler(SchedulerMixin, ConfigMixin):
 
     def __len__(self):
         return self.config.num_train_timesteps
+
+
+class FlowUniPCBatchScheduler:
+    """
+    Batched version of `FlowUniPCMultistepScheduler` for diffusion forcing, where every latent frame follows its own
+    trajectory and is updated at its own pace. All the frames share the same sigmas, so the predictor and corrector
+    coefficients only depend on the number of steps already done by a frame: they are tabulated once and any subset of
+    frames is then stepped with a few tensor ops, without a loop over the frames nor any device sync.
+
+    Only the configuration used by Wan is supported (flow prediction of x0, no thresholding, no solver_p).
+
+    Args:
+        scheduler (`FlowUniPCMultistepScheduler`):
+            A scheduler on which `set_timesteps` has been called, that provides the sigmas and the configuration.
+        sample (`torch.Tensor`):
+            The latents [C, F, H, W], used to size the per frame history.
+    """
+
+    def __init__(self, scheduler, sample):
+        config = scheduler.config
+        if not scheduler.predict_x0 or config.thresholding or scheduler.solver_p is not None or config.prediction_type != "flow_prediction":
+            raise NotImplementedError("FlowUniPCBatchScheduler only supports the flow prediction of x0 without thresholding nor solver_p")
+        device = sample.device
+        self.order = config.solver_order
+        sigmas = scheduler.sigmas.tolist()
+        predictor, corrector = self.get_coefficients(sigmas, len(scheduler.timesteps), self.order, config.solver_type, config.lower_order_final, scheduler.disable_corrector)
+        self.sigmas = torch.tensor(sigmas, dtype=torch.float32, device=device)
+        self.predictor = torch.tensor(predictor, dtype=torch.float32, device=device)
+        self.corrector = torch.tensor(corrector, dtype=torch.float32, device=device)
+        self.step_index = torch.zeros(sample.shape[1], dtype=torch.long, device=device)
+        self.model_outputs = torch.zeros((self.order,) + tuple(sample.shape), dtype=sample.dtype, device=device)
+        self.last_sample = torch.zeros_like(sample)
+
+    @staticmethod
+    def get_coefficients(sigmas, num_steps, solver_order, solver_type, lower_order_final, disable_corrector):
+        # predictor[k]: weights of (corrected sample, model_outputs[0 .. order-1]) to go from step k to step k+1
+        # corrector[k]: weights of (sample, last_sample, converted model output, model_outputs[0 .. order-1]) to correct
+        # the sample at step k, model_outputs being the history of converted outputs before the update (newest last)
+        def lambda_(sigma):
+            return math.log(1 - sigma) - math.log(sigma) if sigma > 0 else math.inf
+
+        def bh_coefficients(t, s0, previous, order):
+            h = lambda_(sigmas[t]) - lambda_(sigmas[s0])
+            rks = [(lambda_(sigmas[si]) - lambda_(sigmas[s0])) / h for si in previous] + [1.0]
+            hh = -h
+            h_phi_1 = math.expm1(hh)
+            h_phi_k = h_phi_1 / hh - 1
+            B_h = hh if solver_type == "bh1" else math.expm1(hh)
+            factorial_i = 1
+            R, b = [], []
+            for i in range(1, order + 1):
+                R.append([rk ** (i - 1) for rk in rks])
+                b.append(h_phi_k * factorial_i / B_h)
+                factorial_i *= i + 1
+                h_phi_k = h_phi_k / hh - 1 / factorial_i
+            return rks, R, b, h_phi_1, B_h, 1 - sigmas[t]
+
+        def solve(R, b):
+            return torch.linalg.solve(torch.tensor(R, dtype=torch.float64), torch.tensor(b, dtype=torch.float64)).tolist()
+
+        def get_order(k):
+            this_order = min(solver_order, num_steps - k) if lower_order_final else solver_order
+            return min(this_order, k + 1)
+
+        predictor, corrector = [], []
+        newest = solver_order - 1
+        for k in range(num_steps):
+            order = get_order(k)
+            rks, R, b, h_phi_1, B_h, alpha_t = bh_coefficients(k + 1, k, [k - i for i in range(1, order)], order)
+            weights = [0.0] * (solver_order + 1)
+            weights[0] = sigmas[k + 1] / sigmas[k]
+            weights[1 + newest] = -alpha_t * h_phi_1
+            if order > 1:
+                rhos_p = [0.5] if order == 2 else solve([row[:-1] for row in R[:-1]], b[:-1])
+                for i in range(1, order):
+                    c = alpha_t * B_h * rhos_p[i - 1] / rks[i - 1]
+                    weights[1 + newest - i] -= c
+                    weights[1 + newest] += c
+            predictor.append(weights)
+
+            weights = [0.0] * (solver_order + 3)
+            if k == 0 or k - 1 in disable_corrector:
+                weights[0] = 1.0
+            else:
+                order = get_order(k - 1)
+                rks, R, b, h_phi_1, B_h, alpha_t = bh_coefficients(k, k - 1, [k - 1 - i for i in range(1, order)], order)
+                rhos_c = [0.5] if order == 1 else solve(R, b)
+                weights[1] = sigmas[k] / sigmas[k - 1]
+                weights[2] = -alpha_t * B_h * rhos_c[-1]
+                weights[3 + newest] = -alpha_t * h_phi_1 + alpha_t * B_h * rhos_c[-1]
+                for i in range(1, order):
+                    c = alpha_t * B_h * rhos_c[i - 1] / rks[i - 1]
+                    weights[3 + newest - i] -= c
+                    weights[3 + newest] += c
+            corrector.append(weights)
+        return predictor, corrector
+
+    def step(self, model_output, sample, indexes):
+        """
+        Steps the frames `indexes` (a LongTensor of frame numbers), `model_output` and `sample` being their [C, f, H, W]
+        model output and current latents. Returns their latents at their next step.
+        """
+        def weights(table, k):
+            # [f, J] -> [J, 1, f, 1, 1]
+            w = table[k].t()
+            return w.view(w.shape[0], 1, -1, 1, 1)
+
+        k = self.step_index[indexes]
+        model_output = sample - self.sigmas[k].view(1, -1, 1, 1) * model_output
+        history = self.model_outputs[:, :, indexes]
+        terms = torch.cat([torch.stack([sample, self.last_sample[:, indexes], model_output]), history])
+        sample = (weights(self.corrector, k) * terms).sum(0)
+        history = torch.cat([history[1:], model_output.unsqueeze(0)])
+        prev_sample = (weights(self.predictor, k) * torch.cat([sample.unsqueeze(0), history])).sum(0)
+        self.model_outputs[:, :, indexes] = history
+        self.last_sample[:, indexes] = sample
+        self.step_index[indexes] += 1
+        return prev_sample
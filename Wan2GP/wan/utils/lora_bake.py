@@ -0,0 +1,185 @@
+import os
+import hashlib
+import threading
+import torch
+from mmgp import safetensors2
+
+
+class LoraBaker:
+    """
+    Fuses the deltas of a set of Loras with constant multipliers into the weights of the transformer ("bake" mode), so that
+    no Lora is applied at runtime. The merged weights of the modules affected by the Loras are cached on disk, keyed by the
+    base model, the Lora files and the multipliers, and are memory mapped when the same combination is used again.
+    Baking modifies the resident weights in place: the model has to be reloaded to use another combination. The baked
+    combination is recorded on the model itself as several models may be kept loaded.
+    """
+
+    # bumped when the merged weights change, so that stale cache entries are not reused
+    cache_version = 2
+    prefixes = ("diffusion_model.", "transformer.")
+    # recorded before the weights are modified in place: if baking fails halfway, the model has to be reloaded whatever the request
+    incomplete_bake = ("incomplete bake",)
+    suffixes = ((".lora_A.weight", 0), (".lora_down.weight", 0), (".lora_B.weight", 1), (".lora_up.weight", 1), (".diff", 2), (".diff_b", 3), (".alpha", 4))
+
+    def __init__(self, cache_dir, max_size_mb=32768):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def needs_reload(model, request):
+        # a baked model can't be reverted, it has to be reloaded if another Lora combination is requested
+        baked_request = getattr(model, "_baked_loras_request", None)
+        return baked_request != None and baked_request != request
+
+    def get_key(self, model_filename, loras, multipliers, dtype):
+        key = [f"v{self.cache_version}", os.path.basename(model_filename), str(dtype)]
+        for lora, multiplier in zip(loras, multipliers):
+            stat = os.stat(lora)
+            key.append(f"{os.path.abspath(lora)}:{stat.st_size}:{stat.st_mtime_ns}:{float(multiplier)}")
+        return hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".safetensors")
+
+    def collect_deltas(self, model, loras, multipliers, preprocess_sd):
+        # returns {module name: [(multiplier, lora_A, lora_B, diff, diff_b, alpha), ...]} or None if a Lora can't be baked
+        modules = {}
+        for lora, multiplier in zip(loras, multipliers):
+            sd = safetensors2.torch_load_file(lora, writable_tensors=False)
+            if preprocess_sd != None:
+                sd = preprocess_sd(sd)
+            lora_modules = {}
+            for k, v in sd.items():
+                for prefix in self.prefixes:
+                    if k.startswith(prefix):
+                        k = k[len(prefix):]
+                        break
+                for suffix, slot in self.suffixes:
+                    if k.endswith(suffix):
+                        lora_modules.setdefault(k[:-len(suffix)], [None] * 5)[slot] = v
+                        break
+                else:
+                    # LoKr, DoRA, ... are only supported at runtime
+                    return None
+            for name, data in lora_modules.items():
+                modules.setdefault(name, []).append([float(multiplier)] + data)
+            sd = lora_modules = None
+
+        for name, deltas in modules.items():
+            try:
+                module = model.get_submodule(name)
+            except AttributeError:
+                return None
+            weight = getattr(module, "weight", None)
+            if weight is None or getattr(module, "weight_qtype", None) != None:
+                # quantized weights can't be merged without requantizing them
+                return None
+            for _, lora_A, lora_B, diff, diff_b, _ in deltas:
+                if (lora_A is None) != (lora_B is None):
+                    return None
+                if lora_A is not None and (lora_B.shape[0], lora_A.shape[1]) != weight.shape:
+                    return None
+                if diff is not None:
+                    # full weight deltas are ignored by mmgp at runtime, baking them would render differently
+                    return None
+                if diff_b is not None and (module.bias is None or diff_b.shape != module.bias.shape):
+                    return None
+        return modules
+
+    @torch.no_grad()
+    def merge(self, model, modules, device):
+        baked_sd = {}
+        for name, deltas in modules.items():
+            module = model.get_submodule(name)
+            weight = module.weight.data.to(device, torch.float32)
+            bias = None
+            for multiplier, lora_A, lora_B, diff, diff_b, alpha in deltas:
+                # same scaling as mmgp at runtime: alpha is used as stored (preprocess_loras has already divided the alpha
+                # of Kohya Loras by their rank)
+                scale = multiplier * (float(alpha) if alpha is not None else 1.)
+                if lora_A is not None:
+                    weight.addmm_(lora_B.to(device, torch.float32), lora_A.to(device, torch.float32), alpha=scale)
+                if diff_b is not None:
+                    if bias is None:
+                        bias = module.bias.data.to(device, torch.float32)
+                    bias.add_(diff_b.to(device, torch.float32), alpha=scale)
+            module.weight.data.copy_(weight)
+            baked_sd[name + ".weight"] = module.weight.data
+            if bias is not None:
+                module.bias.data.copy_(bias)
+                baked_sd[name + ".bias"] = module.bias.data
+            weight = bias = None
+        return baked_sd
+
+    def bake(self, model, model_filename, loras, multipliers, preprocess_sd=None, request=None, device="cuda"):
+        # returns True if the Loras have been fused in the model weights, False if they have to be applied at runtime
+        baked_request = getattr(model, "_baked_loras_request", None)
+        if baked_request != None:
+            return baked_request == request
+        key = self.get_key(model_filename, loras, multipliers, next(model.parameters()).dtype)
+        path = self.get_path(key)
+        baked_sd = None
+        if os.path.isfile(path):
+            try:
+                baked_sd = safetensors2.torch_load_file(path, writable_tensors=False)
+                os.utime(path) # refresh the LRU position
+            except Exception as e:
+                print(f"Unable to read baked Loras '{path}': {e}")
+                baked_sd = None
+        if baked_sd != None:
+            modules_dict = dict(model.named_parameters())
+            if any(k not in modules_dict or modules_dict[k].shape != v.shape for k, v in baked_sd.items()):
+                return False
+            model._baked_loras_request = self.incomplete_bake
+            with torch.no_grad():
+                for k, v in baked_sd.items():
+                    modules_dict[k].data.copy_(v)
+        else:
+            modules = self.collect_deltas(model, loras, multipliers, preprocess_sd)
+            if modules == None:
+                return False
+            model._baked_loras_request = self.incomplete_bake
+            baked_sd = self.merge(model, modules, device)
+            modules = None
+            try:
+                self.save(path, baked_sd)
+            except Exception as e:
+                # the merge has succeeded, only the cache entry is lost
+                print(f"Unable to save baked Loras '{path}': {e}")
+                if os.path.isfile(path + ".tmp"):
+                    os.remove(path + ".tmp")
+        baked_sd = None
+        model._baked_loras_request = request
+        return True
+
+    def save(self, path, baked_sd):
+        if self.max_size <= 0:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        safetensors2.torch_write_file({k: v.cpu() for k, v in baked_sd.items()}, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for file_name in os.listdir(self.cache_dir):
+                if not file_name.endswith(".safetensors"):
+                    continue
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                except OSError:
+                    pass
@@ -0,0 +1,117 @@
+import os
+import json
+import struct
+import threading
+
+
+class LoraIndex:
+    """
+    Persistent index of the Lora files, keyed by (path, size, mtime).
+    It stores the rank and the target modules read from the safetensors header and, for each model type, whether the
+    Lora has been found compatible, so that a Lora directory can be rescanned without opening the files that didn't change.
+    """
+
+    extensions = (".sft", ".safetensors")
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.modified = False
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print(f"Unable to read Lora index '{self.index_path}': {e}")
+            self.entries = {}
+
+    def save(self):
+        with self.lock:
+            if not self.modified:
+                return
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+            self.modified = False
+
+    @staticmethod
+    def read_header(path):
+        # only the json header of the safetensors file is read, not the tensors
+        with open(path, "rb") as f:
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_size))
+        rank = 0
+        modules = set()
+        for key, value in header.items():
+            if key == "__metadata__":
+                continue
+            for suffix in (".lora_down.weight", ".lora_A.weight", ".lora_up.weight", ".lora_B.weight", ".diff", ".diff_b", ".alpha"):
+                if key.endswith(suffix):
+                    modules.add(key[:-len(suffix)])
+                    if suffix in (".lora_down.weight", ".lora_A.weight"):
+                        rank = max(rank, value["shape"][0])
+                    break
+        return rank, sorted(modules)
+
+    def scan(self, lora_dir):
+        # incremental rescan: only the files that are new or whose size / mtime has changed are opened
+        abs_lora_dir = os.path.abspath(lora_dir)
+        found, found_keys = [], set()
+        with os.scandir(lora_dir) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith(self.extensions) or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                found.append(os.path.join(lora_dir, dir_entry.name))
+                path = os.path.join(abs_lora_dir, dir_entry.name)
+                found_keys.add(path)
+                entry = self.entries.get(path, None)
+                if entry != None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                    continue
+                try:
+                    rank, modules = self.read_header(path)
+                    error = None
+                except Exception as e:
+                    rank, modules, error = 0, [], str(e)
+                with self.lock:
+                    self.entries[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "rank": rank, "modules": modules, "error": error, "compatible": {}}
+                    self.modified = True
+
+        with self.lock:
+            for path in [path for path in self.entries if os.path.dirname(path) == abs_lora_dir and path not in found_keys]:
+                del self.entries[path]
+                self.modified = True
+        self.save()
+        found.sort()
+        return found
+
+    def get(self, path):
+        return self.entries.get(os.path.abspath(path), None)
+
+    def get_compatibility(self, path, model_type):
+        # None if the Lora has not been checked yet for this model type
+        entry = self.get(path)
+        if entry == None:
+            return None
+        if entry["error"] != None:
+            return False
+        return entry["compatible"].get(model_type, None)
+
+    def set_compatibility(self, path, model_type, compatible):
+        entry = self.get(path)
+        if entry == None:
+            return
+        with self.lock:
+            if entry["compatible"].get(model_type, None) != compatible:
+                entry["compatible"][model_type] = compatible
+                self.modified = True
+
+    def filter_compatible(self, loras, model_type):
+        return [lora for lora in loras if self.get_compatibility(lora, model_type) != False]
@@ -0,0 +1,59 @@
+import gc
+import threading
+from collections import OrderedDict
+
+
+class ModelPool:
+    """
+    Warm pool of loaded models that are not currently in use. Each entry keeps its offload object (weights in pinned
+    host RAM), so that switching back to a model only moves it to the GPU instead of reloading it from disk.
+    Entries are evicted in least recently used order when their total size exceeds max_size_mb.
+    """
+
+    def __init__(self, max_size_mb=0):
+        self.max_size = max_size_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set_max_size(self, max_size_mb):
+        self.max_size = max_size_mb * 1024 * 1024
+        self.evict()
+
+    def enabled(self):
+        return self.max_size > 0
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def take(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return None if entry == None else entry[0]
+
+    def put(self, key, item, size, release):
+        # release(item) is called when the entry is evicted
+        if size > self.max_size:
+            release(item)
+            return
+        with self.lock:
+            self.entries[key] = (item, size, release)
+        self.evict()
+
+    def evict(self, keep_size = None):
+        released = []
+        with self.lock:
+            max_size = self.max_size if keep_size == None else keep_size
+            total_size = sum(size for _, size, _ in self.entries.values())
+            while total_size > max_size and len(self.entries) > 0:
+                _, (item, size, release) = self.entries.popitem(last=False)
+                released.append((item, release))
+                total_size -= size
+        for item, release in released:
+            release(item)
+        if len(released) > 0:
+            released = None
+            gc.collect()
+
+    def release_all(self):
+        self.evict(keep_size = 0)
@@ -0,0 +1,54 @@
+class QueueScheduler:
+    """
+    Orders the pending tasks of a queue to reduce the cost of switching from one task to the next one (model reloads,
+    Lora swaps, recompilations). switch_cost(previous_params, params) returns the estimated cost in seconds.
+    Tasks with a higher priority are run first, pinned tasks keep their position and the tasks around them are only
+    reordered between two pinned tasks. Among tasks of the same priority, the cheapest switch is picked first and
+    ties keep the current order of the tasks.
+    """
+
+    def __init__(self, switch_cost):
+        self.switch_cost = switch_cost
+
+    def order(self, previous_params, tasks):
+        ordered = []
+        segment = []
+        for task in tasks:
+            if task.get("pinned", False):
+                ordered += self.order_segment(previous_params if len(ordered) == 0 else ordered[-1]["params"], segment)
+                ordered.append(task)
+                segment = []
+            else:
+                segment.append(task)
+        ordered += self.order_segment(previous_params if len(ordered) == 0 else ordered[-1]["params"], segment)
+        return ordered
+
+    def order_segment(self, previous_params, tasks):
+        # greedy: the next task is the cheapest one to switch to among the ones with the highest priority
+        remaining = list(tasks)
+        ordered = []
+        while len(remaining) > 0:
+            max_priority = max(task.get("priority", 0) for task in remaining)
+            best_task, best_cost = None, None
+            for task in remaining:
+                if task.get("priority", 0) != max_priority:
+                    continue
+                cost = self.switch_cost(previous_params, task["params"])
+                if best_cost == None or cost < best_cost:
+                    best_task, best_cost = task, cost
+            remaining.remove(best_task)
+            ordered.append(best_task)
+            previous_params = best_task["params"]
+        return ordered
+
+    def total_cost(self, previous_params, tasks):
+        cost = 0
+        for task in tasks:
+            cost += self.switch_cost(previous_params, task["params"])
+            previous_params = task["params"]
+        return cost
+
+    def estimate_savings(self, previous_params, tasks):
+        # compared with running the tasks in the order they have been added
+        fifo_order = sorted(tasks, key=lambda task: task["id"])
+        return self.total_cost(previous_params, fifo_order) - self.total_cost(previous_params, tasks)
@@ -1,45 +1,38 @@
 # based on FramePack https://github.com/lllyasviel/FramePack
 
-import time
 import traceback
 
-from threading import Thread, Lock
+from collections import deque
+from queue import SimpleQueue
+from threading import Thread, Lock, Condition
 
 
 class Listener:
-    task_queue = []
+    task_queue = SimpleQueue()
     lock = Lock()
     thread = None
-    
+
     @classmethod
     def _process_tasks(cls):
         while True:
-            task = None
-            with cls.lock:
-                if cls.task_queue:
-                    task = cls.task_queue.pop(0)
-                    
-            if task is None:
-                time.sleep(0.001)
-                continue
-                
-            func, args, kwargs = task
+            # blocks until a task is available instead of polling
+            func, args, kwargs = cls.task_queue.get()
             try:
                 func(*args, **kwargs)
             except Exception as e:
-                tb = traceback.format_exc().split('\n')[:-1] 
+                tb = traceback.format_exc().split('\n')[:-1]
                 print('\n'.join(tb))
 
                 # print(f"Error in listener thread: {e}")
-    
+
     @classmethod
     def add_task(cls, func, *args, **kwargs):
-        with cls.lock:
-            cls.task_queue.append((func, args, kwargs))
+        cls.task_queue.put((func, args, kwargs))
 
-        if cls.thread is None:
-            cls.thread = Thread(target=cls._process_tasks, daemon=True)
-            cls.thread.start()
+        with cls.lock:
+            if cls.thread is None:
+                cls.thread = Thread(target=cls._process_tasks, daemon=True)
+                cls.thread.start()
 
 
 def async_run(func, *args, **kwargs):
@@ -47,36 +40,46 @@ def async_run(func, *args, **kwargs):
 
 
 class FIFOQueue:
-    def __init__(self):
-        self.queue = []
-        self.lock = Lock()
+    def __init__(self, coalesce = ()):
+        # commands listed in 'coalesce' only matter through their latest value: a new one replaces a pending one
+        # as long as only other coalescable commands have been pushed since
+        self.queue = deque()
+        self.coalesce = set(coalesce)
+        self.condition = Condition()
 
     def push(self, cmd, data = None):
-        with self.lock:
+        with self.condition:
+            if cmd in self.coalesce:
+                for i in range(len(self.queue) - 1, -1, -1):
+                    pending_cmd, _ = self.queue[i]
+                    if pending_cmd not in self.coalesce:
+                        break
+                    if pending_cmd == cmd:
+                        self.queue[i] = (cmd, data)
+                        return
             self.queue.append( (cmd, data) )
+            self.condition.notify()
 
     def pop(self):
-        with self.lock:
+        with self.condition:
             if self.queue:
-                return self.queue.pop(0)
+                return self.queue.popleft()
             return None
 
     def top(self):
-        with self.lock:
+        with self.condition:
             if self.queue:
                 return self.queue[0]
             return None
 
     def next(self):
-        while True:
-            with self.lock:
-                if self.queue:
-                    return self.queue.pop(0)
-
-            time.sleep(0.001)
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+            return self.queue.popleft()
 
 
 class AsyncStream:
     def __init__(self):
         self.input_queue = FIFOQueue()
-        self.output_queue = FIFOQueue()
+        self.output_queue = FIFOQueue(coalesce = ("progress", "preview"))
@@ -3,6 +3,9 @@ import argparse
 import binascii
 import os
 import os.path as osp
+import queue
+import threading
+import traceback
 import torchvision.transforms.functional as TF
 import torch.nn.functional as F
 
@@ -15,7 +18,7 @@ import numpy as np
 from rembg import remove, new_session
 import random
 
-__all__ = ['cache_video', 'cache_image', 'str2bool']
+__all__ = ['cache_video', 'cache_image', 'str2bool', 'VideoStreamWriter', 'concat_video_segments']
 
 
 
@@ -70,6 +73,64 @@ def resize_lanczos(img, h, w):
     return torch.from_numpy(np.array(img).astype(np.float32) / 255.0).movedim(-1, 0)
 
 
+def get_lanczos_weights(in_size, out_size, a=3, device=None, dtype=torch.float32):
+    # dense [out_size, in_size] resampling matrix of a Lanczos filter, same support / normalization as PIL (kernel widened when downscaling)
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    centers = (torch.arange(out_size, dtype=torch.float64) + 0.5) * scale
+    positions = torch.arange(in_size, dtype=torch.float64) + 0.5
+    x = (positions[None, :] - centers[:, None]) / filter_scale
+    weights = torch.sinc(x) * torch.sinc(x / a) * (x.abs() < a)
+    weights /= weights.sum(dim=1, keepdim=True)
+    return weights.to(device=device, dtype=dtype)
+
+def resize_lanczos_video(video, h, w, device=None, chunk_size=16, num_threads=8):
+    """
+    Lanczos resize of a whole [C, T, H, W] video with values in [0, 1].
+    On a cuda device frames are resampled by chunks with two matrix products (separable filter), otherwise
+    each frame goes through PIL in a thread pool.
+    """
+    if device is None or not torch.device(device).type == "cuda" or not torch.cuda.is_available():
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            frames = list(executor.map(lambda i: resize_lanczos(video[:, i], h, w), range(video.shape[1])))
+        return torch.stack(frames, dim=1)
+
+    in_h, in_w = video.shape[-2:]
+    weights_h = get_lanczos_weights(in_h, h, device=device)
+    weights_w = get_lanczos_weights(in_w, w, device=device).t()
+    output = torch.empty((video.shape[0], video.shape[1], h, w), dtype=torch.float32)
+    for start in range(0, video.shape[1], chunk_size):
+        frames = video[:, start:start + chunk_size].to(device=device, dtype=torch.float32, non_blocking=True)
+        frames = torch.matmul(torch.matmul(weights_h, frames), weights_w).clamp_(0, 1)
+        output[:, start:start + chunk_size] = frames.cpu()
+    return output
+
+
+def resize_frames_lanczos(frames, h, w, device=None, chunk_size=16, num_threads=8):
+    """
+    Lanczos resize of uint8 frames [T, H, W, C] (torch tensor), returned as a contiguous uint8 numpy array [T, h, w, C].
+    Same cuda / thread pool split as resize_lanczos_video.
+    """
+    output = np.empty((frames.shape[0], h, w, frames.shape[-1]), dtype=np.uint8)
+    if device is None or not torch.device(device).type == "cuda" or not torch.cuda.is_available():
+        from concurrent.futures import ThreadPoolExecutor
+        def resize_frame(i):
+            img = Image.fromarray(frames[i].cpu().numpy())
+            output[i] = np.asarray(img.resize((w, h), resample=Image.Resampling.LANCZOS))
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(resize_frame, range(frames.shape[0])))
+        return output
+
+    in_h, in_w = frames.shape[1:3]
+    weights_h = get_lanczos_weights(in_h, h, device=device)
+    weights_w = get_lanczos_weights(in_w, w, device=device).t()
+    for start in range(0, frames.shape[0], chunk_size):
+        chunk = frames[start:start + chunk_size].to(device=device, non_blocking=True).permute(0, 3, 1, 2).float()
+        chunk = torch.matmul(torch.matmul(weights_h, chunk), weights_w).round_().clamp_(0, 255)
+        output[start:start + chunk_size] = chunk.to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+    return output
+
 def remove_background(img, session=None):
     if session ==None:
         session = new_session() 
@@ -129,6 +190,130 @@ def rand_name(length=8, suffix=''):
     return name
 
 
+class VideoStreamWriter:
+    """
+    Encodes video frames on a background thread while the caller keeps working.
+
+    Frames are handed over as [C, T, H, W] tensors (in any number of calls), converted to uint8
+    in chunks on the device they live on and streamed to a single persistent ffmpeg writer.
+    Only references are queued, so pushing a decoded window costs no copy on the caller side.
+    """
+
+    def __init__(self,
+                 save_file,
+                 fps=30,
+                 codec='libx264',
+                 quality=8,
+                 normalize=True,
+                 value_range=(-1, 1),
+                 chunk_size=16):
+        self.save_file = save_file
+        self.fps = fps
+        self.codec = codec
+        self.quality = quality
+        self.normalize = normalize
+        self.value_range = value_range
+        self.chunk_size = chunk_size
+        self.frames_written = 0
+        self.error = None
+        self._callback = None
+        self._closed = False
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _to_uint8(self, frames):
+        # same conversion as torchvision.utils.make_grid(normalize=True) followed by (x * 255).type(torch.uint8)
+        low, high = min(self.value_range), max(self.value_range)
+        frames = frames.clamp(low, high)
+        if self.normalize:
+            frames = frames.sub_(low).div_(max(high - low, 1e-5))
+        return frames.mul_(255).to(torch.uint8).permute(1, 2, 3, 0).cpu()
+
+    def _run(self):
+        writer = None
+        try:
+            writer = imageio.get_writer(self.save_file, fps=self.fps, codec=self.codec, quality=self.quality)
+            while True:
+                frames = self._queue.get()
+                if frames is None:
+                    break
+                for start in range(0, frames.shape[1], self.chunk_size):
+                    for frame in self._to_uint8(frames[:, start:start + self.chunk_size]).numpy():
+                        writer.append_data(frame)
+                        self.frames_written += 1
+                frames = None
+        except Exception as e:
+            self.error = e
+            # keep draining so that close() never waits on a dead consumer
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+        if self.error is not None:
+            print(f'video writer failed, error: {self.error}', flush=True)
+        if self._callback is not None:
+            try:
+                self._callback(self.result)
+            except Exception:
+                traceback.print_exc()
+
+    @property
+    def result(self):
+        return self.save_file if self.error is None else None
+
+    def write(self, frames):
+        """Queues a [C, T, H, W] tensor for encoding. The tensor must not be modified in place afterwards."""
+        if self._closed:
+            raise RuntimeError('VideoStreamWriter is closed')
+        if frames.shape[1] > 0:
+            self._queue.put(frames)
+
+    def close(self, wait=True, callback=None):
+        """
+        Finalizes the container. With wait=False returns immediately, 'callback(save_file or None)' being then called
+        from the writer thread once the file is complete.
+        """
+        if not self._closed:
+            self._closed = True
+            self._callback = callback
+            self._queue.put(None)
+        if wait:
+            return self.join()
+        return None
+
+    def join(self):
+        self._thread.join()
+        return self.result
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+
+def concat_video_segments(segment_files, save_file):
+    """
+    Joins mp4 segments that share the same encoding settings without re-encoding them (ffmpeg concat demuxer + stream copy),
+    so that assembling a video generated with sliding windows is only disk I/O.
+    """
+    import subprocess
+    list_file = save_file + ".segments.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        for segment_file in segment_files:
+            segment_file = osp.abspath(segment_file).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{segment_file}'\n")
+    try:
+        command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", "-loglevel", "warning", "-nostats", save_file]
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_file)
+    return save_file
+
+
 def cache_video(tensor,
                 save_file=None,
                 fps=30,
@@ -141,33 +326,26 @@ def cache_video(tensor,
     cache_file = osp.join('/tmp', rand_name(
         suffix=suffix)) if save_file is None else save_file
 
+    # preprocess once, only the encoding is retried
+    if tensor.shape[0] == 1:
+        frames = tensor[0]
+    else:
+        tensor = tensor.clamp(min(value_range), max(value_range))
+        frames = torch.stack([
+            torchvision.utils.make_grid(
+                u, nrow=nrow, normalize=normalize, value_range=value_range)
+            for u in tensor.unbind(2)
+        ],
+                             dim=1)
+        normalize = False
+
     # save to cache
-    error = None
     for _ in range(retry):
-        try:
-            # preprocess
-            tensor = tensor.clamp(min(value_range), max(value_range))
-            tensor = torch.stack([
-                torchvision.utils.make_grid(
-                    u, nrow=nrow, normalize=normalize, value_range=value_range)
-                for u in tensor.unbind(2)
-            ],
-                                 dim=1).permute(1, 2, 3, 0)
-            tensor = (tensor * 255).type(torch.uint8).cpu()
-
-            # write video
-            writer = imageio.get_writer(
-                cache_file, fps=fps, codec='libx264', quality=8)
-            for frame in tensor.numpy():
-                writer.append_data(frame)
-            writer.close()
+        writer = VideoStreamWriter(cache_file, fps=fps, normalize=normalize, value_range=value_range)
+        writer.write(frames)
+        if writer.close() is not None:
             return cache_file
-        except Exception as e:
-            error = e
-            continue
-    else:
-        print(f'cache_video failed, error: {error}', flush=True)
-        return None
+    return None
 
 
 def cache_image(tensor,
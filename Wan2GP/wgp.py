@@ -25,7 +25,7 @@ import random
 import json
 import wan
 from wan.configs import MAX_AREA_CONFIGS, WAN_CONFIGS, SUPPORTED_SIZES, VACE_SIZE_CONFIGS
-from wan.utils.utils import cache_video
+from wan.utils.utils import VideoStreamWriter, concat_video_segments
 from wan.modules.attention import get_attention_modes, get_supported_attention_modes
 import torch
 import gc
@@ -507,6 +507,7 @@ def add_video_task(**inputs):
         "start_image_data_base64": [pil_to_base64_uri(img, format="jpeg", quality=70) for img in start_image_data] if start_image_data != None else None,
         "end_image_data_base64": [pil_to_base64_uri(img, format="jpeg", quality=70) for img in end_image_data] if end_image_data != None else None
     })
+    schedule_queue(queue)
     return update_queue_data(queue)
 
 def update_task_thumbnails(task,  inputs):
@@ -528,6 +529,9 @@ def move_up(queue, selected_indices):
         if idx > 0:
             idx += 1
             queue[idx], queue[idx-1] = queue[idx-1], queue[idx]
+            if queue_scheduling == 1:
+                # a task placed by hand is pinned, otherwise the scheduler would move it back
+                queue[idx-1]["pinned"] = True
     return update_queue_data(queue)
 
 def move_down(queue, selected_indices):
@@ -541,6 +545,9 @@ def move_down(queue, selected_indices):
         idx += 1
         if idx < len(queue)-1:
             queue[idx], queue[idx+1] = queue[idx+1], queue[idx]
+            if queue_scheduling == 1:
+                # a task placed by hand is pinned, otherwise the scheduler would move it back
+                queue[idx+1]["pinned"] = True
     return update_queue_data(queue)
 
 def remove_task(queue, selected_indices):
@@ -557,6 +564,78 @@ def remove_task(queue, selected_indices):
             del queue[idx]
     return update_queue_data(queue)
 
+def cycle_task_priority(queue, selected_indices):
+    # normal -> high priority -> pinned (keeps its position) -> normal
+    if not selected_indices or len(selected_indices) == 0:
+        return update_queue_data(queue)
+    idx = selected_indices[0]
+    if isinstance(idx, list):
+        idx = idx[0]
+    idx = int(idx) + 1
+    with lock:
+        if 0 < idx < len(queue):
+            task = queue[idx]
+            if task.get("pinned", False):
+                task["pinned"] = False
+            elif task.get("priority", 0) > 0:
+                task["priority"] = 0
+                task["pinned"] = True
+                # the task is pinned where the user placed it, not where its priority has moved it
+                previous_task_id = task.pop("previous_task_id", None)
+                del queue[idx]
+                ids = [t["id"] for t in queue]
+                queue.insert(ids.index(previous_task_id) + 1 if previous_task_id in ids[1:] else 1, task)
+            else:
+                task["priority"] = 1
+                task["previous_task_id"] = queue[idx-1]["id"]
+    schedule_queue(queue)
+    return update_queue_data(queue)
+
+def get_switch_cost(previous_params, params):
+    # estimated time in s to switch from a task to the next one and its reasons
+    model_filename = params["model_filename"]
+    previous_model_filename = transformer_filename if previous_params == None else previous_params["model_filename"]
+    cost, reasons = 0, []
+    if model_filename != previous_model_filename:
+        if model_filename in model_pool.keys():
+            cost += model_load_times.get((model_filename, "warm"), 5)
+            reasons.append("warm model")
+        else:
+            cost += model_load_times.get(model_filename, 90 if "14B" in model_filename else 30)
+            reasons.append("model load")
+    loras_changed = previous_params == None or (previous_params.get("activated_loras", []), previous_params.get("loras_multipliers", "")) != (params.get("activated_loras", []), params.get("loras_multipliers", ""))
+    if model_filename == previous_model_filename and loras_changed:
+        if lora_bake_mode == 1 and previous_params != None and len(previous_params.get("activated_loras", [])) > 0:
+            # baked Loras can only be removed by reloading the model
+            cost += model_load_times.get(model_filename, 90 if "14B" in model_filename else 30)
+            reasons.append("model reload")
+        elif lora_bake_mode != 1 and len(params.get("activated_loras", [])) > 0:
+            cost += 5
+            reasons.append("Loras")
+    if lora_bake_mode == 1 and len(params.get("activated_loras", [])) > 0 and (loras_changed or model_filename != previous_model_filename):
+        # the Loras have to be merged (or read from the bake cache) into a model that is not baked yet
+        cost += 15
+        reasons.append("Lora bake")
+    if len(compile) > 0 and (previous_params == None or model_filename != previous_model_filename or 
+        (previous_params.get("resolution"), previous_params.get("video_length")) != (params.get("resolution"), params.get("video_length"))):
+        cost += 60
+        reasons.append("compilation")
+    return cost, reasons
+
+def estimate_switch_cost(previous_params, params):
+    return get_switch_cost(previous_params, params)[0]
+
+def schedule_queue(queue, previous_params = None, start = 1):
+    # reorders the pending tasks queue[start:] to group them by model / Loras / resolution, queue[0] is the task in progress
+    if queue_scheduling != 1:
+        return
+    with lock:
+        if len(queue) <= start + 1:
+            return
+        if start > 0:
+            previous_params = queue[start-1]["params"]
+        queue[start:] = queue_scheduler.order(previous_params, queue[start:])
+
 def update_global_queue_ref(queue):
     global global_queue_ref
     with lock:
@@ -661,6 +740,8 @@ def save_queue_action(state):
             manifest_entry = {
                 "id": task.get('id'),
                 "params": params_copy,
+                "priority": task.get('priority'),
+                "pinned": task.get('pinned'),
             }
             manifest_entry = {k: v for k, v in manifest_entry.items() if v is not None}
             queue_manifest.append(manifest_entry)
@@ -699,6 +780,193 @@ def save_queue_action(state):
         finally:
             zip_buffer.close()
 
+def load_task_media(params, media_dir, loaded_cache_dir):
+    # media are referenced by file names relative to media_dir, images are loaded and videos are copied to the cache dir
+    image_keys = ["image_start", "image_end", "image_refs"]
+    video_keys = ["video_guide", "video_mask", "video_source", "audio_guide"]
+
+    for key in image_keys:
+        image_filenames = params.get(key)
+        if image_filenames is None: continue
+
+        is_list = isinstance(image_filenames, list)
+        if not is_list: image_filenames = [image_filenames]
+
+        loaded_pils = []
+        for img_filename_in_zip in image_filenames:
+             if not isinstance(img_filename_in_zip, str):
+                 print(f"[load_queue] Warning: Non-string filename found for image key '{key}'. Skipping.")
+                 continue
+             img_load_path = os.path.join(media_dir, img_filename_in_zip)
+             if not os.path.exists(img_load_path):
+                 print(f"[load_queue] Image file not found in extracted data: {img_load_path}. Skipping.")
+                 continue
+             try:
+                 pil_image = Image.open(img_load_path)
+                 pil_image.load()
+                 converted_image = convert_image(pil_image)
+                 loaded_pils.append(converted_image)
+                 pil_image.close()
+                 print(f"Loaded image: {img_filename_in_zip} for key {key}")
+             except Exception as img_e:
+                 print(f"[load_queue] Error loading image {img_filename_in_zip}: {img_e}")
+        if loaded_pils:
+            params[key] = loaded_pils if is_list else loaded_pils[0]
+        else:
+            params.pop(key, None)
+
+    for key in video_keys:
+        video_filename_in_zip = params.get(key)
+        if video_filename_in_zip is None or not isinstance(video_filename_in_zip, str):
+            continue
+
+        video_load_path = os.path.join(media_dir, video_filename_in_zip)
+        if not os.path.exists(video_load_path):
+            print(f"[load_queue] Video file not found in extracted data: {video_load_path}. Skipping.")
+            params.pop(key, None)
+            continue
+
+        persistent_video_path = os.path.join(loaded_cache_dir, os.path.basename(video_filename_in_zip))
+        try:
+            shutil.copy2(video_load_path, persistent_video_path)
+            params[key] = persistent_video_path
+            print(f"Loaded video: {video_filename_in_zip} -> {persistent_video_path}")
+        except Exception as vid_e:
+            print(f"[load_queue] Error copying video {video_filename_in_zip} to cache: {vid_e}")
+            params.pop(key, None)
+
+def build_runtime_task(task_data, params):
+    primary_preview_pil_list, secondary_preview_pil_list = get_preview_images(params)
+
+    start_b64 = [pil_to_base64_uri(primary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(primary_preview_pil_list, list) and primary_preview_pil_list else None
+    end_b64 = [pil_to_base64_uri(secondary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(secondary_preview_pil_list, list) and secondary_preview_pil_list else None
+
+    top_level_start_image = params.get("image_start") or params.get("image_refs")
+    top_level_end_image = params.get("image_end")
+
+    return {
+        "id": task_data.get('id', 0),
+        "params": params.copy(),
+        "priority": task_data.get('priority', 0),
+        "pinned": task_data.get('pinned', False),
+        "repeats": params.get('repeat_generation', 1),
+        "length": params.get('video_length'),
+        "steps": params.get('num_inference_steps'),
+        "prompt": params.get('prompt'),
+        "start_image_data": top_level_start_image,
+        "end_image_data": top_level_end_image,
+        "start_image_data_base64": start_b64,
+        "end_image_data_base64": end_b64,
+    }
+
+def read_queue_file(filename, state, loaded_cache_dir):
+    newly_loaded_queue = []
+    os.makedirs(loaded_cache_dir, exist_ok=True)
+    print(f"[load_queue] Using cache directory: {loaded_cache_dir}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with zipfile.ZipFile(filename, 'r') as zf:
+            if "queue.json" not in zf.namelist(): raise ValueError("queue.json not found in zip file")
+            print(f"[load_queue] Extracting {filename} to {tmpdir}")
+            zf.extractall(tmpdir)
+            print(f"[load_queue] Extraction complete.")
+
+        manifest_path = os.path.join(tmpdir, "queue.json")
+        print(f"[load_queue] Reading manifest: {manifest_path}")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            loaded_manifest = json.load(f)
+        print(f"[load_queue] Manifest loaded. Processing {len(loaded_manifest)} tasks.")
+
+        for task_index, task_data in enumerate(loaded_manifest):
+            if task_data is None or not isinstance(task_data, dict):
+                print(f"[load_queue] Skipping invalid task data at index {task_index}")
+                continue
+
+            params = task_data.get('params', {})
+            params['state'] = state
+            fill_missing_task_params(params)
+            load_task_media(params, tmpdir, loaded_cache_dir)
+            newly_loaded_queue.append(build_runtime_task(task_data, params))
+            print(f"[load_queue] Reconstructed task {task_index+1}/{len(loaded_manifest)}, ID: {task_data.get('id', 0)}")
+
+    return newly_loaded_queue
+
+# values used by the UI when a setting is missing from a settings file
+task_settings_defaults = {
+    "negative_prompt": "",
+    "multi_images_gen_type": 0,
+    "audio_guidance_scale": 5.0,
+    "embedded_guidance_scale": 6.0,
+    "tea_cache_setting": 0,
+    "tea_cache_start_step_perc": 0,
+    "fbc_setting": 0,
+    "fbc_layers": 1,
+    "fbc_start_step_perc": 10,
+    "activated_loras": [],
+    "loras_multipliers": "",
+    "image_prompt_type": "S",
+    "model_mode": 0,
+    "keep_frames_video_source": "",
+    "video_prompt_type": "",
+    "keep_frames_video_guide": "",
+    "sliding_window_size": 81,
+    "sliding_window_overlap": 5,
+    "sliding_window_overlap_noise": 20,
+    "sliding_window_discard_last_frames": 0,
+    "remove_background_images_ref": 1,
+    "temporal_upsampling": "",
+    "spatial_upsampling": "",
+    "RIFLEx_setting": 0,
+    "slg_switch": 0,
+    "slg_layers": [9],
+    "slg_start_perc": 10,
+    "slg_end_perc": 90,
+    "cfg_star_switch": 0,
+    "cfg_zero_step": -1,
+    "prompt_enhancer": "",
+}
+
+def fill_missing_task_params(params):
+    # queues saved by a previous version lack the parameters of generate_video that have been added since then
+    for k in list(inspect.signature(generate_video).parameters)[2:]:
+        if k not in params:
+            params[k] = task_settings_defaults.get(k, None)
+
+def get_task_params_from_settings(settings):
+    # settings / metadata files only contain the values that differ from the defaults of the model
+    model_filename = settings.get("model_filename", transformer_filename)
+    ui_defaults = get_default_settings(model_filename)
+    ui_defaults.update(settings)
+    params = {}
+    for k in list(inspect.signature(generate_video).parameters)[2:]:
+        params[k] = ui_defaults.get(k, task_settings_defaults.get(k, None))
+    params["model_filename"] = model_filename
+    return params
+
+def read_task_file(filename, state, loaded_cache_dir):
+    # a task file contains a queue entry ({"id": ..., "params": {...}}), a list of queue entries or the settings of a video,
+    # media file names are relative to the task file
+    with open(filename, 'r', encoding='utf-8') as f:
+        loaded_tasks = json.load(f)
+    if not isinstance(loaded_tasks, list):
+        loaded_tasks = [loaded_tasks]
+    os.makedirs(loaded_cache_dir, exist_ok=True)
+
+    tasks = []
+    for task_data in loaded_tasks:
+        if task_data is None or not isinstance(task_data, dict):
+            continue
+        if "params" in task_data:
+            params = task_data["params"]
+            fill_missing_task_params(params)
+        else:
+            params, task_data = get_task_params_from_settings(task_data), {}
+        params['state'] = state
+        load_task_media(params, os.path.dirname(filename), loaded_cache_dir)
+        tasks.append(build_runtime_task(task_data, params))
+    return tasks
+
+
 def load_queue_action(filepath, state, evt:gr.EventData):
     global task_id
 
@@ -724,118 +992,12 @@ def load_queue_action(filepath, state, evt:gr.EventData):
 
 
     newly_loaded_queue = []
-    max_id_in_file = 0
     error_message = ""
     local_queue_copy_for_global_ref = None
 
     try:
         print(f"[load_queue_action] Attempting to load queue from: {filename}")
-        os.makedirs(loaded_cache_dir, exist_ok=True)
-        print(f"[load_queue_action] Using cache directory: {loaded_cache_dir}")
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            with zipfile.ZipFile(filename, 'r') as zf:
-                if "queue.json" not in zf.namelist(): raise ValueError("queue.json not found in zip file")
-                print(f"[load_queue_action] Extracting {filename} to {tmpdir}")
-                zf.extractall(tmpdir)
-                print(f"[load_queue_action] Extraction complete.")
-
-            manifest_path = os.path.join(tmpdir, "queue.json")
-            print(f"[load_queue_action] Reading manifest: {manifest_path}")
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                loaded_manifest = json.load(f)
-            print(f"[load_queue_action] Manifest loaded. Processing {len(loaded_manifest)} tasks.")
-
-            for task_index, task_data in enumerate(loaded_manifest):
-                if task_data is None or not isinstance(task_data, dict):
-                    print(f"[load_queue_action] Skipping invalid task data at index {task_index}")
-                    continue
-
-                params = task_data.get('params', {})
-                task_id_loaded = task_data.get('id', 0)
-                max_id_in_file = max(max_id_in_file, task_id_loaded)
-                params['state'] = state
-
-                image_keys = ["image_start", "image_end", "image_refs"]
-                video_keys = ["video_guide", "video_mask", "video_source", "audio_guide"]
-
-                loaded_pil_images = {}
-                loaded_video_paths = {}
-
-                for key in image_keys:
-                    image_filenames = params.get(key)
-                    if image_filenames is None: continue
-
-                    is_list = isinstance(image_filenames, list)
-                    if not is_list: image_filenames = [image_filenames]
-
-                    loaded_pils = []
-                    for img_filename_in_zip in image_filenames:
-                         if not isinstance(img_filename_in_zip, str):
-                             print(f"[load_queue_action] Warning: Non-string filename found for image key '{key}'. Skipping.")
-                             continue
-                         img_load_path = os.path.join(tmpdir, img_filename_in_zip)
-                         if not os.path.exists(img_load_path):
-                             print(f"[load_queue_action] Image file not found in extracted data: {img_load_path}. Skipping.")
-                             continue
-                         try:
-                             pil_image = Image.open(img_load_path)
-                             pil_image.load()
-                             converted_image = convert_image(pil_image)
-                             loaded_pils.append(converted_image)
-                             pil_image.close()
-                             print(f"Loaded image: {img_filename_in_zip} for key {key}")
-                         except Exception as img_e:
-                             print(f"[load_queue_action] Error loading image {img_filename_in_zip}: {img_e}")
-                    if loaded_pils:
-                        params[key] = loaded_pils if is_list else loaded_pils[0]
-                        loaded_pil_images[key] = params[key]
-                    else:
-                        params.pop(key, None)
-
-                for key in video_keys:
-                    video_filename_in_zip = params.get(key)
-                    if video_filename_in_zip is None or not isinstance(video_filename_in_zip, str):
-                        continue
-
-                    video_load_path = os.path.join(tmpdir, video_filename_in_zip)
-                    if not os.path.exists(video_load_path):
-                        print(f"[load_queue_action] Video file not found in extracted data: {video_load_path}. Skipping.")
-                        params.pop(key, None)
-                        continue
-
-                    persistent_video_path = os.path.join(loaded_cache_dir, video_filename_in_zip)
-                    try:
-                        shutil.copy2(video_load_path, persistent_video_path)
-                        params[key] = persistent_video_path
-                        loaded_video_paths[key] = persistent_video_path
-                        print(f"Loaded video: {video_filename_in_zip} -> {persistent_video_path}")
-                    except Exception as vid_e:
-                        print(f"[load_queue_action] Error copying video {video_filename_in_zip} to cache: {vid_e}")
-                        params.pop(key, None)
-
-                primary_preview_pil_list, secondary_preview_pil_list = get_preview_images(params)
-
-                start_b64 = [pil_to_base64_uri(primary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(primary_preview_pil_list, list) and primary_preview_pil_list else None
-                end_b64 = [pil_to_base64_uri(secondary_preview_pil_list[0], format="jpeg", quality=70)] if isinstance(secondary_preview_pil_list, list) and secondary_preview_pil_list else None
-
-                top_level_start_image = params.get("image_start") or params.get("image_refs")
-                top_level_end_image = params.get("image_end")
-
-                runtime_task = {
-                    "id": task_id_loaded,
-                    "params": params.copy(),
-                    "repeats": params.get('repeat_generation', 1),
-                    "length": params.get('video_length'),
-                    "steps": params.get('num_inference_steps'),
-                    "prompt": params.get('prompt'),
-                    "start_image_data": top_level_start_image,
-                    "end_image_data": top_level_end_image,
-                    "start_image_data_base64": start_b64,
-                    "end_image_data_base64": end_b64,
-                }
-                newly_loaded_queue.append(runtime_task)
-                print(f"[load_queue_action] Reconstructed task {task_index+1}/{len(loaded_manifest)}, ID: {task_id_loaded}")
+        newly_loaded_queue = read_queue_file(filename, state, loaded_cache_dir)
 
         with lock:
             print("[load_queue_action] Acquiring lock to update state...")
@@ -1087,6 +1249,8 @@ def get_queue_table(queue):
         end_img_uri = item.get('end_image_data_base64')
         end_img_uri = end_img_uri[0] if end_img_uri !=None else None
         thumbnail_size = "50px"
+        switch_cost, switch_reasons = get_switch_cost(queue[i-1]["params"], item["params"])
+        switch_cell = f'<span title="{", ".join(switch_reasons)}">~{switch_cost:.0f}s</span>' if switch_cost > 0 else ""
         num_steps = item.get('steps')
         length = item.get('length')
         start_img_md = ""
@@ -1105,9 +1269,20 @@ def get_queue_table(queue):
                     end_img_md,
                     "↑",
                     "↓",
-                    "✖"
+                    "✖",
+                    switch_cell,
+                    "📌" if item.get("pinned", False) else ("▲" if item.get("priority", 0) > 0 else "·")
                     ])    
     return data
+
+def get_queue_headers(queue):
+    headers = ["Qty","Prompt", "Length","Steps","", "", "", "", "", "Switch", "Pri"]
+    if queue_scheduling == 1 and len(queue) > 2:
+        savings = queue_scheduler.estimate_savings(queue[0]["params"], queue[1:])
+        if savings > 0:
+            headers[9] = f"Switch (saves ~{savings:.0f}s)"
+    return headers
+
 def update_queue_data(queue):
     update_global_queue_ref(queue)
     data = get_queue_table(queue)
@@ -1115,7 +1290,7 @@ def update_queue_data(queue):
     if len(data) == 0:
         return gr.DataFrame(visible=False)
     else:
-        return gr.DataFrame(value=data, visible= True)
+        return gr.DataFrame(value=data, headers=get_queue_headers(queue), visible= True)
 
 def create_html_progress_bar(percentage=0.0, text="Idle", is_idle=True):
     bar_class = "progress-bar-custom idle" if is_idle else "progress-bar-custom"
@@ -1427,6 +1602,34 @@ def _parse_args():
     help="vae config mode"
     )    
 
+    parser.add_argument(
+        "--process",
+        type=str,
+        default="",
+        help="Run without the web interface the tasks of a queue zip file, a task json file or a folder of them"
+    )
+
+    parser.add_argument(
+        "--watch",
+        type=str,
+        default="",
+        help="Run without the web interface the queue zip / task json files dropped in this folder"
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="",
+        help="Folder where the generated videos are saved (overrides the configuration)"
+    )
+
+    parser.add_argument(
+        "--progress-jsonl",
+        type=str,
+        default="",
+        help="File to which the progress events of --process / --watch are appended as json lines"
+    )
+
     args = parser.parse_args()
 
     return args
@@ -1749,6 +1952,9 @@ def get_default_settings(filename):
             "loras_multipliers": "",
             "tea_cache": 0.0,
             "tea_cache_start_step_perc": 0,
+            "fbc_setting": 0,
+            "fbc_layers": 1,
+            "fbc_start_step_perc": 10,
             "RIFLEx_setting": 0,
             "slg_switch": 0,
             "slg_layers": [9],
@@ -1839,7 +2045,7 @@ transformer_filename = get_model_filename(transformer_type, transformer_quantiza
 text_encoder_quantization =server_config.get("text_encoder_quantization", "int8")
 attention_mode = server_config["attention_mode"]
 if len(args.attention)> 0:
-    if args.attention in ["auto", "sdpa", "sage", "sage2", "flash", "xformers"]:
+    if args.attention in ["auto", "sdpa", "sage", "sage2", "flash", "xformers", "autotune"]:
         attention_mode = args.attention
         lock_ui_attention = True
     else:
@@ -1856,6 +2062,25 @@ reload_needed = False
 default_ui = server_config.get("default_ui", "t2v") 
 save_path = server_config.get("save_path", os.path.join(os.getcwd(), "gradio_outputs"))
 preload_model_policy = server_config.get("preload_model_policy", []) 
+preprocessing_cache_size = server_config.get("preprocessing_cache_size", 2048)
+preview_interval = server_config.get("preview_interval", 1.0)
+teacache_residual_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}.get(server_config.get("teacache_residual_dtype", ""), None)
+cross_attn_kv_cache = server_config.get("cross_attn_kv_cache", 0) == 1
+from wan.modules.t5 import text_embeddings_cache
+text_embeddings_cache.max_entries = server_config.get("text_encoder_cache_size", 64)
+text_embeddings_cache.cache_dir = os.path.join("ckpts", "cache", "text_embeddings") if server_config.get("text_encoder_disk_cache", 0) == 1 else None
+from wan.utils.lora_index import LoraIndex
+lora_index = LoraIndex(os.path.join("ckpts", "cache", "lora_index.json"))
+from wan.utils.lora_bake import LoraBaker
+lora_bake_mode = server_config.get("lora_bake_mode", 0)
+lora_baker = LoraBaker(os.path.join("ckpts", "cache", "baked_loras"), server_config.get("lora_bake_cache_size", 32768))
+from wan.utils.model_pool import ModelPool
+model_pool = ModelPool(server_config.get("model_pool_size", 0))
+from wan.utils.queue_scheduler import QueueScheduler
+queue_scheduling = server_config.get("queue_scheduling", 0)
+queue_scheduler = QueueScheduler(estimate_switch_cost)
+# measured model load times (s), used to estimate the cost of switching between tasks
+model_load_times = {}
 
 
 if args.t2v_14B or args.t2v: 
@@ -2073,16 +2298,23 @@ def setup_loras(model_filename, transformer,  lora_dir, lora_preselected_preset,
 
 
     if lora_dir != None:
-        dir_loras =  glob.glob( os.path.join(lora_dir , "*.sft") ) + glob.glob( os.path.join(lora_dir , "*.safetensors") ) 
-        dir_loras.sort()
+        dir_loras = lora_index.scan(lora_dir)
         loras += [element for element in dir_loras if element not in loras ]
 
         dir_presets =  glob.glob( os.path.join(lora_dir , "*.lset") ) 
         dir_presets.sort()
         loras_presets = [ Path(Path(file_path).parts[-1]).stem for file_path in dir_presets]
 
+    model_type = get_model_type(model_filename)
     if transformer !=None:
-        loras = offload.load_loras_into_model(transformer, loras,  activate_all_loras=False, check_only= True, preprocess_sd=get_loras_preprocessor(transformer, model_filename), split_linear_modules_map = split_linear_modules_map) #lora_multiplier,
+        # only the Loras that have not been validated yet for this model type are opened
+        unchecked_loras = [lora for lora in loras if lora_index.get_compatibility(lora, model_type) == None]
+        if len(unchecked_loras) > 0:
+            valid_loras = offload.load_loras_into_model(transformer, unchecked_loras,  activate_all_loras=False, check_only= True, preprocess_sd=get_loras_preprocessor(transformer, model_filename), split_linear_modules_map = split_linear_modules_map) #lora_multiplier,
+            for lora in unchecked_loras:
+                lora_index.set_compatibility(lora, model_type, lora in valid_loras)
+            lora_index.save()
+    loras = lora_index.filter_compatible(loras, model_type)
 
     if len(loras) > 0:
         loras_names = [ Path(lora).stem for lora in loras  ]
@@ -2180,6 +2412,11 @@ def load_hunyuan_model(model_filename, quantizeTransformer = False, dtype = torc
 
     return hunyuan_model, pipe
 
+def release_temporal_upsampler():
+    if "rife.inference" in sys.modules:
+        from rife.inference import release_models
+        release_models()
+
 def get_transformer_model(model):
     if hasattr(model, "model"):
         return model.model
@@ -2243,12 +2480,41 @@ def load_models(model_filename):
 
         
     offloadobj = offload.profile(pipe, profile_no= profile, compile = compile, quantizeTransformer = quantizeTransformer, loras = "transformer", coTenantsMap= {}, perc_reserved_mem_max = perc_reserved_mem_max , convertWeightsFloatTo = transformer_dtype, **kwargs)  
+    # host RAM used by the model, taken into account by the warm model pool
+    wan_model._model_size = sum(p.numel() * p.element_size() for model in pipe.values() for p in model.parameters())
     if len(args.gpu) > 0:
         torch.set_default_device(args.gpu)
     transformer_filename = new_transformer_filename
     transformer_loras_filenames = new_transformer_loras_filenames
     return wan_model, offloadobj, pipe["transformer"] 
 
+def release_current_model(keep_warm = False):
+    # if keep_warm is set and the warm model pool is enabled, the current model is moved out of the GPU and kept loaded
+    global wan_model, offloadobj
+    if wan_model != None and offloadobj is not None and keep_warm and model_pool.enabled():
+        offloadobj.unload_all()
+        # the prompt enhancer models belong to the pipe of the model
+        prompt_enhancer = (prompt_enhancer_image_caption_model, prompt_enhancer_image_caption_processor, prompt_enhancer_llm_model, prompt_enhancer_llm_tokenizer)
+        model_pool.put(transformer_filename, (wan_model, offloadobj, transformer_loras_filenames, prompt_enhancer), wan_model._model_size, lambda entry: entry[1].release())
+    elif offloadobj is not None:
+        offloadobj.release()
+    wan_model, offloadobj = None, None
+    release_temporal_upsampler()
+    gc.collect()
+
+def acquire_model(model_filename):
+    # reuses a model of the warm pool if there is one, otherwise loads it
+    global transformer_filename, transformer_loras_filenames
+    global prompt_enhancer_image_caption_model, prompt_enhancer_image_caption_processor, prompt_enhancer_llm_model, prompt_enhancer_llm_tokenizer
+    entry = model_pool.take(model_filename)
+    if entry == None:
+        return load_models(model_filename)
+    wan_model, offloadobj, transformer_loras_filenames, prompt_enhancer = entry
+    prompt_enhancer_image_caption_model, prompt_enhancer_image_caption_processor, prompt_enhancer_llm_model, prompt_enhancer_llm_tokenizer = prompt_enhancer
+    transformer_filename = model_filename
+    offload.last_offload_obj = offloadobj
+    return wan_model, offloadobj, get_transformer_model(wan_model)
+
 if not "P" in preload_model_policy:
     wan_model, offloadobj, transformer = None, None, None
     reload_needed = True
@@ -2320,7 +2586,17 @@ def apply_changes(  state,
                     UI_theme_choice = "default",
                     enhancer_enabled_choice = 0,
                     fit_canvas_choice = 0,
-                    preload_in_VRAM_choice = 0
+                    preload_in_VRAM_choice = 0,
+                    lora_bake_mode_choice = 0,
+                    model_pool_size_choice = 0,
+                    queue_scheduling_choice = 0,
+                    preprocessing_cache_size_choice = 2048,
+                    text_encoder_cache_size_choice = 64,
+                    text_encoder_disk_cache_choice = 0,
+                    preview_interval_choice = 1.0,
+                    teacache_residual_dtype_choice = "",
+                    cross_attn_kv_cache_choice = 0,
+                    lora_bake_cache_size_choice = 32768
 ):
     if args.lock_config:
         return
@@ -2345,7 +2621,17 @@ def apply_changes(  state,
                      "UI_theme" : UI_theme_choice,
                      "fit_canvas": fit_canvas_choice,
                      "enhancer_enabled" : enhancer_enabled_choice,
-                     "preload_in_VRAM" : preload_in_VRAM_choice
+                     "preload_in_VRAM" : preload_in_VRAM_choice,
+                     "lora_bake_mode" : lora_bake_mode_choice,
+                     "model_pool_size" : model_pool_size_choice,
+                     "queue_scheduling" : queue_scheduling_choice,
+                     "preprocessing_cache_size" : preprocessing_cache_size_choice,
+                     "text_encoder_cache_size" : text_encoder_cache_size_choice,
+                     "text_encoder_disk_cache" : text_encoder_disk_cache_choice,
+                     "preview_interval" : preview_interval_choice,
+                     "teacache_residual_dtype" : teacache_residual_dtype_choice,
+                     "cross_attn_kv_cache" : cross_attn_kv_cache_choice,
+                     "lora_bake_cache_size" : lora_bake_cache_size_choice
                        }
 
     if Path(server_config_filename).is_file():
@@ -2368,7 +2654,7 @@ def apply_changes(  state,
         if v != v_old:
             changes.append(k)
 
-    global attention_mode, profile, compile, vae_config, boost, lora_dir, reload_needed, preload_model_policy, transformer_quantization, transformer_dtype_policy, transformer_types, text_encoder_quantization
+    global attention_mode, profile, compile, vae_config, boost, lora_dir, reload_needed, preload_model_policy, transformer_quantization, transformer_dtype_policy, transformer_types, text_encoder_quantization, lora_bake_mode, queue_scheduling, preprocessing_cache_size, preview_interval, teacache_residual_dtype, cross_attn_kv_cache
     attention_mode = server_config["attention_mode"]
     profile = server_config["profile"]
     compile = server_config["compile"]
@@ -2380,12 +2666,26 @@ def apply_changes(  state,
     transformer_dtype_policy = server_config["transformer_dtype_policy"]
     text_encoder_quantization = server_config["text_encoder_quantization"]
     transformer_types = server_config["transformer_types"]
+    lora_bake_mode = server_config["lora_bake_mode"]
+    model_pool.set_max_size(server_config["model_pool_size"])
+    queue_scheduling = server_config["queue_scheduling"]
+    preprocessing_cache_size = server_config["preprocessing_cache_size"]
+    if guide_cache != None:
+        guide_cache.set_max_size(preprocessing_cache_size)
+    text_embeddings_cache.max_entries = server_config["text_encoder_cache_size"]
+    text_embeddings_cache.cache_dir = os.path.join("ckpts", "cache", "text_embeddings") if server_config["text_encoder_disk_cache"] == 1 else None
+    preview_interval = server_config["preview_interval"]
+    teacache_residual_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}.get(server_config["teacache_residual_dtype"], None)
+    cross_attn_kv_cache = server_config["cross_attn_kv_cache"] == 1
+    lora_baker.max_size = server_config["lora_bake_cache_size"] * 1024 * 1024
     model_filename = get_model_filename(get_model_type(state["model_filename"]), transformer_quantization, transformer_dtype_policy)
     state["model_filename"] = model_filename
-    if all(change in ["attention_mode", "vae_config", "boost", "save_path", "metadata_type", "clear_file_list", "fit_canvas"] for change in changes ):
+    if all(change in ["attention_mode", "vae_config", "boost", "save_path", "metadata_type", "clear_file_list", "fit_canvas", "lora_bake_mode", "model_pool_size", "queue_scheduling", "preprocessing_cache_size", "text_encoder_cache_size", "text_encoder_disk_cache", "preview_interval", "teacache_residual_dtype", "cross_attn_kv_cache", "lora_bake_cache_size"] for change in changes ):
         model_choice = gr.Dropdown()
     else:
         reload_needed = True
+        # the models kept in the pool have been loaded with the previous config
+        model_pool.release_all()
         model_choice = generate_dropdown_model_list(model_filename)
 
     header = generate_header(state["model_filename"], compile=compile, attention_mode= attention_mode)
@@ -2396,6 +2696,14 @@ def apply_changes(  state,
 from moviepy.editor import ImageSequenceClip
 import numpy as np
 
+pending_video_writers = []
+
+def wait_for_video_writers():
+    while len(pending_video_writers) > 0:
+        pending_video_writers.pop(0).join()
+
+atexit.register(wait_for_video_writers)
+
 def save_video(final_frames, output_path, fps=24):
     assert final_frames.ndim == 4 and final_frames.shape[3] == 3, f"invalid shape: {final_frames} (need t h w c)"
     if final_frames.dtype != np.uint8:
@@ -2413,6 +2721,7 @@ def get_gen_info(state):
 def build_callback(state, pipe, send_cmd, status, num_inference_steps):
     gen = get_gen_info(state)
     gen["num_inference_steps"] = num_inference_steps
+    gen["last_preview_time"] = 0
     def callback(step_idx, latent, force_refresh, read_state = False, override_num_inference_steps = -1, pass_no = -1):
         refresh_id =  gen.get("refresh", -1)
         if force_refresh or step_idx >= 0:
@@ -2461,8 +2770,10 @@ def build_callback(state, pipe, send_cmd, status, num_inference_steps):
         # progress(*progress_args)
         send_cmd("progress", progress_args)
         if latent != None:
-            latent = latent.to("cpu", non_blocking=True)
-            send_cmd("preview", latent)
+            now = time.time()
+            if now - gen.get("last_preview_time", 0) >= preview_interval:
+                gen["last_preview_time"] = now
+                send_cmd("preview", prepare_preview(latent, get_model_family(transformer_filename)))
             
         # gen["progress_args"] = progress_args
             
@@ -2593,8 +2904,26 @@ def get_resampled_video(video_in, start_frame, max_frames, target_fps):
     frames_list = reader.get_batch(frame_nos)
     return frames_list
 
+guide_cache = None
+
+def get_guide_cache():
+    global guide_cache
+    if guide_cache == None and preprocessing_cache_size > 0:
+        from preprocessing.guide_cache import GuideVideoCache
+        guide_cache = GuideVideoCache(os.path.join("ckpts", "cache", "guides"), preprocessing_cache_size)
+    return guide_cache
+
 def preprocess_video(process_type, height, width, video_in, max_frames, start_frame=0, fit_canvas = False, target_fps = 16, block_size = 16):
 
+    cache, cache_key = None, None
+    if process_type in ("pose", "depth", "gray"):
+        cache = get_guide_cache()
+    if cache != None:
+        cache_key = cache.get_key(video_in, process_type, height = height, width = width, max_frames = max_frames, start_frame = start_frame, fit_canvas = fit_canvas, target_fps = target_fps, block_size = block_size)
+        np_frames = cache.load(cache_key)
+        if np_frames is not None:
+            return torch.from_numpy(np_frames)
+
     frames_list = get_resampled_video(video_in, start_frame, max_frames, target_fps)
 
     if len(frames_list) == 0:
@@ -2614,11 +2943,8 @@ def preprocess_video(process_type, height, width, video_in, max_frames, start_fr
     #     new_height = height
     #     new_width = width
 
-    processed_frames_list = []
-    for frame in frames_list:
-        frame = Image.fromarray(np.clip(frame.cpu().numpy(), 0, 255).astype(np.uint8))
-        frame = frame.resize((new_width,new_height), resample=Image.Resampling.LANCZOS) 
-        processed_frames_list.append(frame)
+    from wan.utils.utils import resize_frames_lanczos
+    processed_frames = resize_frames_lanczos(frames_list, new_height, new_width, device=processing_device)
 
     if process_type=="pose":
         from preprocessing.dwpose.pose import PoseBodyFaceVideoAnnotator
@@ -2642,19 +2968,18 @@ def preprocess_video(process_type, height, width, video_in, max_frames, start_fr
         anno_ins = None
     
     if anno_ins == None:
-        np_frames = [np.array(frame) for frame in processed_frames_list]
+        np_frames = processed_frames
     else:
-        np_frames = anno_ins.forward(processed_frames_list)
+        np_frames = anno_ins.forward(processed_frames)
 
     # from preprocessing.dwpose.pose import save_one_video
     # save_one_video("test.mp4", np_frames, fps=8, quality=8, macro_block_size=None)
 
-    torch_frames = []
-    for np_frame in np_frames:
-        torch_frame = torch.from_numpy(np_frame)
-        torch_frames.append(torch_frame)
-
-    return torch.stack(torch_frames) 
+    if not isinstance(np_frames, np.ndarray):
+        np_frames = np.stack(np_frames)
+    if cache_key != None:
+        cache.save(cache_key, np_frames)
+    return torch.from_numpy(np_frames)
 
 
 def parse_keep_frames_video_guide(keep_frames, video_length):
@@ -2718,6 +3043,9 @@ def generate_video(
     multi_images_gen_type,
     tea_cache_setting,
     tea_cache_start_step_perc,    
+    fbc_setting,
+    fbc_layers,
+    fbc_start_step_perc,
     activated_loras,
     loras_multipliers,
     image_prompt_type,
@@ -2770,16 +3098,25 @@ def generate_video(
             time.sleep(1)
         
     if model_filename !=  transformer_filename or reload_needed:
-        wan_model = None
-        if offloadobj is not None:
-            offloadobj.release()
-            offloadobj = None
-        gc.collect()
+        release_current_model(keep_warm = not reload_needed)
+        if reload_needed:
+            model_pool.release_all()
         send_cmd("status", f"Loading model {get_model_name(model_filename)}...")
-        wan_model, offloadobj, trans = load_models(model_filename)
+        load_key = (model_filename, "warm") if model_filename in model_pool.keys() else model_filename
+        load_start_time = time.time()
+        wan_model, offloadobj, trans = acquire_model(model_filename)
+        model_load_times[load_key] = time.time() - load_start_time
         send_cmd("status", "Model loaded")
         reload_needed=  False
 
+    # Loras baked in the resident weights can only be removed by reloading the model
+    lora_bake_request = (model_filename, tuple(activated_loras), loras_multipliers)
+    if wan_model != None and lora_baker.needs_reload(get_transformer_model(wan_model), lora_bake_request if lora_bake_mode == 1 else None):
+        release_current_model()
+        send_cmd("status", f"Reloading model {get_model_name(model_filename)}...")
+        wan_model, offloadobj, trans = load_models(model_filename)
+        send_cmd("status", "Model loaded")
+
     if attention_mode == "auto":
         attn = get_auto_attention()
     elif attention_mode in attention_modes_supported:
@@ -2847,8 +3184,26 @@ def generate_video(
         if transformer_loras_filenames != None:
             loras_selected += transformer_loras_filenames
             list_mult_choices_nums.append(1.)
-        offload.load_loras_into_model(trans, loras_selected, list_mult_choices_nums, activate_all_loras=True, preprocess_sd=get_loras_preprocessor(trans, model_filename), pinnedLora=pinnedLora, split_linear_modules_map = split_linear_modules_map) 
-        errors = trans._loras_errors
+        baked = False
+        if lora_bake_mode == 1 and transformer_loras_filenames == None and split_linear_modules_map == None and len(loras_selected) > 0 \
+            and all(not isinstance(multi, list) for multi in list_mult_choices_nums):
+            send_cmd("status", "Baking Loras...")
+            offloadobj.unload_all()
+            baked = lora_baker.bake(trans, model_filename, loras_selected, list_mult_choices_nums[:len(loras_selected)], preprocess_sd=get_loras_preprocessor(trans, model_filename), request = lora_bake_request)
+            if not baked:
+                print("Loras can't be baked in this Transformer (quantized weights or unsupported Lora format), they will be applied at each step")
+        if baked:
+            errors = []
+        else:
+            offload.load_loras_into_model(trans, loras_selected, list_mult_choices_nums, activate_all_loras=True, preprocess_sd=get_loras_preprocessor(trans, model_filename), pinnedLora=pinnedLora, split_linear_modules_map = split_linear_modules_map) 
+            errors = trans._loras_errors
+        # only successes are recorded: a runtime failure may be transient (out of memory, file being copied), Loras are
+        # only hidden by the check_only validation of setup_loras
+        error_paths = [path for path, _ in errors]
+        for lora in loras_selected:
+            if lora not in error_paths:
+                lora_index.set_compatibility(lora, get_model_type(model_filename), True)
+        lora_index.save()
         if len(errors) > 0:
             error_files = [msg for _ ,  msg  in errors]
             raise gr.Error("Error while loading Loras: " + ", ".join(error_files))
@@ -2914,6 +3269,17 @@ def generate_video(
                     trans.coefficients = [-5784.54975374,  5449.50911966, -1811.16591783,   256.27178429, -13.02252404]
                 else:
                         raise gr.Error("Teacache not supported for this model")
+            trans.teacache_residual_dtype = teacache_residual_dtype
+    if get_model_family(model_filename) == "wan":
+        # First Block Cache, only used when Tea Cache is disabled
+        trans.enable_fbcache = fbc_setting > 0 and not trans.enable_teacache
+        if trans.enable_fbcache:
+            trans.fbcache_threshold = fbc_setting
+            trans.fbcache_layers = fbc_layers
+            trans.fbcache_start_step = int(fbc_start_step_perc*num_inference_steps/100)
+            trans.teacache_residual_dtype = teacache_residual_dtype
+        # keeps the projected text K/V of every block for the whole generation (costs some VRAM)
+        trans.enable_cross_attn_cache = cross_attn_kv_cache
     source_video = None
     target_camera = None
     if "recam" in model_filename:
@@ -2968,6 +3334,41 @@ def generate_video(
     first_window_video_length = current_video_length
     original_prompts = prompts.copy()
     gen["sliding_window"] = sliding_window    
+    def finalize_video(segment_writers, segments_dir, video_path, configs):
+        try:
+            segments = [writer.join() for writer in segment_writers]
+            segments = [segment for segment in segments if segment != None]
+            if len(segments) == 0:
+                return
+            written_file = video_path if audio_guide == None else video_path[:-4] + "_tmp.mp4"
+            if len(segments) == 1:
+                shutil.move(segments[0], written_file)
+            else:
+                concat_video_segments(segments, written_file)
+            if audio_guide != None:
+                final_command = [ "ffmpeg", "-y", "-i", written_file, "-i", audio_guide, "-c:v", "copy", "-c:a", "aac", "-shortest", "-loglevel", "warning", "-nostats", video_path, ]
+                import subprocess
+                subprocess.run(final_command, check=True)
+                os.remove(written_file)
+            metadata_choice = server_config.get("metadata_type","metadata")
+            if metadata_choice == "json":
+                with open(video_path.replace('.mp4', '.json'), 'w') as f:
+                    json.dump(configs, f, indent=4)
+            elif metadata_choice == "metadata":
+                from mutagen.mp4 import MP4
+                file = MP4(video_path)
+                file.tags['©cmt'] = [json.dumps(configs)]
+                file.save()
+
+            print(f"New video saved to Path: "+video_path)
+            file_list.append(video_path)
+            file_settings_list.append(configs)
+            send_cmd("output")
+        except Exception:
+            traceback.print_exc()
+        finally:
+            shutil.rmtree(segments_dir, ignore_errors= True)
+
     while not abort: 
         extra_generation += gen.get("extra_orders",0)
         gen["extra_orders"] = 0
@@ -2980,7 +3381,8 @@ def generate_video(
         src_video, src_mask, src_ref_images = None, None, None
         prefix_video = None
         prefix_video_frames_count = 0 
-        frames_already_processed = None
+        video_segments = []
+        video_segments_dir = None
         pre_video_guide = None
         overlapped_latents = None
         window_no = 0
@@ -3024,339 +3426,339 @@ def generate_video(
                 prompt = prompts[0]
                 abort = gen.get("abort", False)
 
-        while not abort:
-            if sliding_window:
-                prompt =  prompts[window_no] if window_no < len(prompts) else prompts[-1]
-            new_extra_windows = gen.get("extra_windows",0)
-            gen["extra_windows"] = 0
-            extra_windows += new_extra_windows
-            max_frames_to_generate +=  new_extra_windows * (sliding_window_size - discard_last_frames - reuse_frames)
-            sliding_window = sliding_window  or extra_windows > 0
-            if sliding_window and window_no > 0:
-                num_frames_generated -= reuse_frames
-                if (max_frames_to_generate - prefix_video_frames_count - num_frames_generated) <  latent_size:
-                    break
-                current_video_length = min(sliding_window_size, ((max_frames_to_generate - num_frames_generated - prefix_video_frames_count + reuse_frames + discard_last_frames) // latent_size) * latent_size + 1 )
+        try:
+            while not abort:
+                if sliding_window:
+                    prompt =  prompts[window_no] if window_no < len(prompts) else prompts[-1]
+                new_extra_windows = gen.get("extra_windows",0)
+                gen["extra_windows"] = 0
+                extra_windows += new_extra_windows
+                max_frames_to_generate +=  new_extra_windows * (sliding_window_size - discard_last_frames - reuse_frames)
+                sliding_window = sliding_window  or extra_windows > 0
+                if sliding_window and window_no > 0:
+                    num_frames_generated -= reuse_frames
+                    if (max_frames_to_generate - prefix_video_frames_count - num_frames_generated) <  latent_size:
+                        break
+                    current_video_length = min(sliding_window_size, ((max_frames_to_generate - num_frames_generated - prefix_video_frames_count + reuse_frames + discard_last_frames) // latent_size) * latent_size + 1 )
 
-            total_windows = initial_total_windows + extra_windows
-            gen["total_windows"] = total_windows
-            if window_no >= total_windows:
-                break
-            window_no += 1
-            gen["window_no"] = window_no
-            return_latent_slice = None 
-            if reuse_frames > 0:                
-                return_latent_slice = slice(-(reuse_frames - 1 + discard_last_frames ) // latent_size, None if discard_last_frames == 0 else -(discard_last_frames // latent_size) )
-
-            if hunyuan_custom or hunyuan_avatar:
-                src_ref_images  = image_refs
-            elif phantom:
-                src_ref_images = image_refs.copy() if image_refs != None else None
-            elif diffusion_forcing or ltxv or vace and "O" in video_prompt_type:
-                if vace:
-                   video_source =  video_guide
-                   video_guide = None
-                if video_source != None and len(video_source) > 0 and window_no == 1:
-                    keep_frames_video_source= 1000 if len(keep_frames_video_source) ==0 else int(keep_frames_video_source) 
-                    keep_frames_video_source =  (keep_frames_video_source // latent_size  ) * latent_size + 1  
-                    prefix_video  = preprocess_video(None, width=width, height=height,video_in=video_source, max_frames= keep_frames_video_source , start_frame = 0, fit_canvas= fit_canvas, target_fps = fps, block_size = 32 if ltxv else 16)
-                    prefix_video  = prefix_video .permute(3, 0, 1, 2)
-                    prefix_video  = prefix_video .float().div_(127.5).sub_(1.) # c, f, h, w
-                    pre_video_guide =  prefix_video[:, -reuse_frames:]
-                    prefix_video_frames_count = pre_video_guide.shape[1]
+                total_windows = initial_total_windows + extra_windows
+                gen["total_windows"] = total_windows
+                if window_no >= total_windows:
+                    break
+                window_no += 1
+                gen["window_no"] = window_no
+                return_latent_slice = None 
+                if reuse_frames > 0:                
+                    return_latent_slice = slice(-(reuse_frames - 1 + discard_last_frames ) // latent_size, None if discard_last_frames == 0 else -(discard_last_frames // latent_size) )
+
+                if hunyuan_custom or hunyuan_avatar:
+                    src_ref_images  = image_refs
+                elif phantom:
+                    src_ref_images = image_refs.copy() if image_refs != None else None
+                elif diffusion_forcing or ltxv or vace and "O" in video_prompt_type:
                     if vace:
-                        height, width  = pre_video_guide.shape[-2:]     
-            if vace:
-                image_refs_copy = image_refs.copy() if image_refs != None else None # required since prepare_source do inplace modifications
-                video_guide_copy = video_guide
-                video_mask_copy = video_mask
-                if any(process in video_prompt_type for process in ("P", "D", "G")) :
-                    preprocess_type = None
-                    if "P" in video_prompt_type :
-                        progress_args = [0, get_latest_status(state,"Extracting Open Pose Information")]
-                        preprocess_type = "pose"
-                    elif "D" in video_prompt_type :
-                        progress_args = [0, get_latest_status(state,"Extracting Depth Information")]
-                        preprocess_type = "depth"
-                    elif "G" in video_prompt_type :
-                        progress_args = [0, get_latest_status(state,"Extracting Gray Level Information")]
-                        preprocess_type = "gray"
-
-                    if preprocess_type != None :
-                        send_cmd("progress", progress_args)
-                        video_guide_copy = preprocess_video(preprocess_type, width=width, height=height,video_in=video_guide, max_frames= current_video_length if window_no == 1 else current_video_length - reuse_frames, start_frame = guide_start_frame, fit_canvas = fit_canvas, target_fps = fps)
-                keep_frames_parsed, error = parse_keep_frames_video_guide(keep_frames_video_guide, max_frames_to_generate)
-                if len(error) > 0:
-                    raise gr.Error(f"invalid keep frames {keep_frames_video_guide}")
-                keep_frames_parsed = keep_frames_parsed[guide_start_frame: guide_start_frame + current_video_length]
-
-                if window_no == 1:
-                    image_size = (height, width) #  default frame dimensions until it is set by video_src (if there is any)
-                
+                       video_source =  video_guide
+                       video_guide = None
+                    if video_source != None and len(video_source) > 0 and window_no == 1:
+                        keep_frames_video_source= 1000 if len(keep_frames_video_source) ==0 else int(keep_frames_video_source) 
+                        keep_frames_video_source =  (keep_frames_video_source // latent_size  ) * latent_size + 1  
+                        prefix_video  = preprocess_video(None, width=width, height=height,video_in=video_source, max_frames= keep_frames_video_source , start_frame = 0, fit_canvas= fit_canvas, target_fps = fps, block_size = 32 if ltxv else 16)
+                        prefix_video  = prefix_video .permute(3, 0, 1, 2)
+                        prefix_video  = prefix_video .float().div_(127.5).sub_(1.) # c, f, h, w
+                        pre_video_guide =  prefix_video[:, -reuse_frames:]
+                        prefix_video_frames_count = pre_video_guide.shape[1]
+                        if vace:
+                            height, width  = pre_video_guide.shape[-2:]     
+                if vace:
+                    image_refs_copy = image_refs.copy() if image_refs != None else None # required since prepare_source do inplace modifications
+                    video_guide_copy = video_guide
+                    video_mask_copy = video_mask
+                    if any(process in video_prompt_type for process in ("P", "D", "G")) :
+                        preprocess_type = None
+                        if "P" in video_prompt_type :
+                            progress_args = [0, get_latest_status(state,"Extracting Open Pose Information")]
+                            preprocess_type = "pose"
+                        elif "D" in video_prompt_type :
+                            progress_args = [0, get_latest_status(state,"Extracting Depth Information")]
+                            preprocess_type = "depth"
+                        elif "G" in video_prompt_type :
+                            progress_args = [0, get_latest_status(state,"Extracting Gray Level Information")]
+                            preprocess_type = "gray"
+
+                        if preprocess_type != None :
+                            send_cmd("progress", progress_args)
+                            video_guide_copy = preprocess_video(preprocess_type, width=width, height=height,video_in=video_guide, max_frames= current_video_length if window_no == 1 else current_video_length - reuse_frames, start_frame = guide_start_frame, fit_canvas = fit_canvas, target_fps = fps)
+                    keep_frames_parsed, error = parse_keep_frames_video_guide(keep_frames_video_guide, max_frames_to_generate)
+                    if len(error) > 0:
+                        raise gr.Error(f"invalid keep frames {keep_frames_video_guide}")
+                    keep_frames_parsed = keep_frames_parsed[guide_start_frame: guide_start_frame + current_video_length]
+
+                    if window_no == 1:
+                        image_size = (height, width) #  default frame dimensions until it is set by video_src (if there is any)
+                    
 
-                src_video, src_mask, src_ref_images = wan_model.prepare_source([video_guide_copy],
-                                                                        [video_mask_copy ],
-                                                                        [image_refs_copy], 
-                                                                        current_video_length, image_size = image_size, device ="cpu",
-                                                                        original_video= "O" in video_prompt_type,
-                                                                        keep_frames=keep_frames_parsed,
-                                                                        start_frame = guide_start_frame,
-                                                                        pre_src_video = [pre_video_guide],
-                                                                        fit_into_canvas = fit_canvas 
-                                                                        )
-            if window_no ==  1:                
-                conditioning_latents_size = ( (prefix_video_frames_count-1) // latent_size) + 1 if prefix_video_frames_count > 0 else 0
-            else:
-                conditioning_latents_size = ( (reuse_frames-1) // latent_size) + 1
-
-            status = get_latest_status(state)
-            gen["progress_status"] = status 
-            gen["progress_phase"] = ("Encoding Prompt", -1 )
-            callback = build_callback(state, trans, send_cmd, status, num_inference_steps)
-            progress_args = [0, merge_status_context(status, "Encoding Prompt")]
-            send_cmd("progress", progress_args)
-
-            if trans.enable_teacache:
-                trans.teacache_counter = 0
-                trans.num_steps = num_inference_steps                
-                trans.teacache_skipped_steps = 0    
-                trans.previous_residual = None
-                trans.previous_modulated_input = None
-
-            # samples = torch.empty( (1,2)) #for testing
-            # if False:
-            
-            try:
-                samples = wan_model.generate(
-                    input_prompt = prompt,
-                    image_start = image_start,  
-                    image_end = image_end if image_end != None else None,
-                    input_frames = src_video,
-                    input_ref_images=  src_ref_images,
-                    input_masks = src_mask,
-                    input_video= pre_video_guide  if diffusion_forcing or ltxv else source_video,
-                    target_camera= target_camera,
-                    frame_num=(current_video_length // latent_size)* latent_size + 1,
-                    height =  height,
-                    width = width,
-                    fit_into_canvas = fit_canvas == 1,
-                    shift=flow_shift,
-                    sampling_steps=num_inference_steps,
-                    guide_scale=guidance_scale,
-                    embedded_guidance_scale=embedded_guidance_scale,
-                    n_prompt=negative_prompt,
-                    seed=seed,
-                    callback=callback,
-                    enable_RIFLEx = enable_RIFLEx,
-                    VAE_tile_size = VAE_tile_size,
-                    joint_pass = joint_pass,
-                    slg_layers = slg_layers,
-                    slg_start = slg_start_perc/100,
-                    slg_end = slg_end_perc/100,
-                    cfg_star_switch = cfg_star_switch,
-                    cfg_zero_step = cfg_zero_step,
-                    audio_cfg_scale= audio_guidance_scale,
-                    audio_guide=audio_guide,
-                    audio_proj= audio_proj_split,
-                    audio_scale= audio_scale,
-                    audio_context_lens= audio_context_lens,
-                    ar_step = model_mode, #5
-                    causal_block_size = 5,
-                    causal_attention = True,
-                    fps = fps,
-                    overlapped_latents = overlapped_latents,
-                    return_latent_slice= return_latent_slice,
-                    overlap_noise = sliding_window_overlap_noise,
-                    conditioning_latents_size = conditioning_latents_size,
-                    model_filename = model_filename,
-                )
-            except Exception as e:
-                if temp_filename!= None and  os.path.isfile(temp_filename):
-                    os.remove(temp_filename)
+                    src_video, src_mask, src_ref_images = wan_model.prepare_source([video_guide_copy],
+                                                                            [video_mask_copy ],
+                                                                            [image_refs_copy], 
+                                                                            current_video_length, image_size = image_size, device ="cpu",
+                                                                            original_video= "O" in video_prompt_type,
+                                                                            keep_frames=keep_frames_parsed,
+                                                                            start_frame = guide_start_frame,
+                                                                            pre_src_video = [pre_video_guide],
+                                                                            fit_into_canvas = fit_canvas 
+                                                                            )
+                if window_no ==  1:                
+                    conditioning_latents_size = ( (prefix_video_frames_count-1) // latent_size) + 1 if prefix_video_frames_count > 0 else 0
+                else:
+                    conditioning_latents_size = ( (reuse_frames-1) // latent_size) + 1
+
+                status = get_latest_status(state)
+                gen["progress_status"] = status 
+                gen["progress_phase"] = ("Encoding Prompt", -1 )
+                callback = build_callback(state, trans, send_cmd, status, num_inference_steps)
+                progress_args = [0, merge_status_context(status, "Encoding Prompt")]
+                send_cmd("progress", progress_args)
+
+                if trans.enable_teacache:
+                    trans.teacache_counter = 0
+                    trans.num_steps = num_inference_steps                
+                    trans.teacache_skipped_steps = 0    
+                    trans.previous_residual = None
+                    trans.previous_modulated_input = None
+                if getattr(trans, "enable_fbcache", False):
+                    trans.num_steps = num_inference_steps
+                    trans.fbcache_skipped_steps = 0
+                    trans.fbcache_trace = []
+
+                # samples = torch.empty( (1,2)) #for testing
+                # if False:
+                
+                try:
+                    samples = wan_model.generate(
+                        input_prompt = prompt,
+                        image_start = image_start,  
+                        image_end = image_end if image_end != None else None,
+                        input_frames = src_video,
+                        input_ref_images=  src_ref_images,
+                        input_masks = src_mask,
+                        input_video= pre_video_guide  if diffusion_forcing or ltxv else source_video,
+                        target_camera= target_camera,
+                        frame_num=(current_video_length // latent_size)* latent_size + 1,
+                        height =  height,
+                        width = width,
+                        fit_into_canvas = fit_canvas == 1,
+                        shift=flow_shift,
+                        sampling_steps=num_inference_steps,
+                        guide_scale=guidance_scale,
+                        embedded_guidance_scale=embedded_guidance_scale,
+                        n_prompt=negative_prompt,
+                        seed=seed,
+                        callback=callback,
+                        enable_RIFLEx = enable_RIFLEx,
+                        VAE_tile_size = VAE_tile_size,
+                        joint_pass = joint_pass,
+                        slg_layers = slg_layers,
+                        slg_start = slg_start_perc/100,
+                        slg_end = slg_end_perc/100,
+                        cfg_star_switch = cfg_star_switch,
+                        cfg_zero_step = cfg_zero_step,
+                        audio_cfg_scale= audio_guidance_scale,
+                        audio_guide=audio_guide,
+                        audio_proj= audio_proj_split,
+                        audio_scale= audio_scale,
+                        audio_context_lens= audio_context_lens,
+                        ar_step = model_mode, #5
+                        causal_block_size = 5,
+                        causal_attention = True,
+                        fps = fps,
+                        overlapped_latents = overlapped_latents,
+                        return_latent_slice= return_latent_slice,
+                        overlap_noise = sliding_window_overlap_noise,
+                        conditioning_latents_size = conditioning_latents_size,
+                        model_filename = model_filename,
+                    )
+                except Exception as e:
+                    if temp_filename!= None and  os.path.isfile(temp_filename):
+                        os.remove(temp_filename)
+                    offload.last_offload_obj.unload_all()
+                    offload.unload_loras_from_model(trans)
+                    release_temporal_upsampler()
+                    # if compile:
+                    #     cache_size = torch._dynamo.config.cache_size_limit                                      
+                    #     torch.compiler.reset()
+                    #     torch._dynamo.config.cache_size_limit = cache_size
+
+                    gc.collect()
+                    torch.cuda.empty_cache()
+                    s = str(e)
+                    keyword_list = {"CUDA out of memory" : "VRAM", "Tried to allocate":"VRAM", "CUDA error: out of memory": "RAM", "CUDA error: too many resources requested": "RAM"}
+                    crash_type = ""
+                    for keyword, tp  in keyword_list.items():
+                        if keyword in s:
+                            crash_type = tp 
+                            break
+                    state["prompt"] = ""
+                    if crash_type == "VRAM":
+                        new_error = "The generation of the video has encountered an error: it is likely that you have unsufficient VRAM and you should therefore reduce the video resolution or its number of frames."
+                    elif crash_type == "RAM":
+                        new_error = "The generation of the video has encountered an error: it is likely that you have unsufficient RAM and / or Reserved RAM allocation should be reduced using 'perc_reserved_mem_max' or using a different Profile."
+                    else:
+                        new_error =  gr.Error(f"The generation of the video has encountered an error, please check your terminal for more information. '{s}'")
+                    tb = traceback.format_exc().split('\n')[:-1] 
+                    print('\n'.join(tb))
+                    if hasattr(trans, "release_teacache_buffers"):
+                        trans.release_teacache_buffers()
+                    send_cmd("error", new_error)
+                    clear_status(state)
+                    return
+                finally:
+                    trans.previous_residual = None
+                    trans.previous_modulated_input = None
+
+                if trans.enable_teacache:
+                    print(f"Teacache Skipped Steps:{trans.teacache_skipped_steps}/{trans.num_steps}" )
+                    if verbose_level >= 2:
+                        for step_no, delta, accumulated, skipped in trans.teacache_trace:
+                            print(f"Teacache step {step_no}: delta={'-' if delta == None else f'{delta:0.4f}'} accumulated={accumulated:0.4f}{' skipped' if skipped else ''}")
+                if getattr(trans, "enable_fbcache", False):
+                    print(f"First Block Cache Skipped Steps:{trans.fbcache_skipped_steps}/{trans.num_steps}" )
+                    if verbose_level >= 2:
+                        for step_no, rel_l1, skipped in trans.fbcache_trace:
+                            print(f"First Block Cache step {step_no}: distance={'-' if rel_l1 == None else f'{rel_l1:0.4f}'}{' skipped' if skipped else ''}")
+
+                if samples != None:
+                    if isinstance(samples, dict):
+                        overlapped_latents = samples.get("latent_slice", None)
+                        samples= samples["x"]
+                    samples = samples.to("cpu")
                 offload.last_offload_obj.unload_all()
-                offload.unload_loras_from_model(trans)
-                # if compile:
-                #     cache_size = torch._dynamo.config.cache_size_limit                                      
-                #     torch.compiler.reset()
-                #     torch._dynamo.config.cache_size_limit = cache_size
-
                 gc.collect()
                 torch.cuda.empty_cache()
-                s = str(e)
-                keyword_list = {"CUDA out of memory" : "VRAM", "Tried to allocate":"VRAM", "CUDA error: out of memory": "RAM", "CUDA error: too many resources requested": "RAM"}
-                crash_type = ""
-                for keyword, tp  in keyword_list.items():
-                    if keyword in s:
-                        crash_type = tp 
-                        break
-                state["prompt"] = ""
-                if crash_type == "VRAM":
-                    new_error = "The generation of the video has encountered an error: it is likely that you have unsufficient VRAM and you should therefore reduce the video resolution or its number of frames."
-                elif crash_type == "RAM":
-                    new_error = "The generation of the video has encountered an error: it is likely that you have unsufficient RAM and / or Reserved RAM allocation should be reduced using 'perc_reserved_mem_max' or using a different Profile."
-                else:
-                    new_error =  gr.Error(f"The generation of the video has encountered an error, please check your terminal for more information. '{s}'")
-                tb = traceback.format_exc().split('\n')[:-1] 
-                print('\n'.join(tb))
-                send_cmd("error", new_error)
-                clear_status(state)
-                return
-            finally:
-                trans.previous_residual = None
-                trans.previous_modulated_input = None
-
-            if trans.enable_teacache:
-                print(f"Teacache Skipped Steps:{trans.teacache_skipped_steps}/{trans.num_steps}" )
-
-            if samples != None:
-                if isinstance(samples, dict):
-                    overlapped_latents = samples.get("latent_slice", None)
-                    samples= samples["x"]
-                samples = samples.to("cpu")
-            offload.last_offload_obj.unload_all()
-            gc.collect()
-            torch.cuda.empty_cache()
-
-            # time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
-            # save_prompt = "_in_" + original_prompts[0]
-            # file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:50]).strip()}.mp4"
-            # sample = samples.cpu()
-            # cache_video( tensor=sample[None].clone(), save_file=os.path.join(save_path, file_name), fps=16, nrow=1, normalize=True, value_range=(-1, 1))
-
-            if samples == None:
-                abort = True
-                state["prompt"] = ""
-                send_cmd("output")  
-            else:
-                sample = samples.cpu()
-                # if True: # for testing
-                #     torch.save(sample, "output.pt")
-                # else:
-                #     sample =torch.load("output.pt")
-                if gen.get("extra_windows",0) > 0:
-                    sliding_window = True 
-                if sliding_window :
-                    guide_start_frame += current_video_length
-                    if discard_last_frames > 0:
-                        sample = sample[: , :-discard_last_frames]
-                        guide_start_frame -= discard_last_frames
-                    if reuse_frames == 0:
-                        pre_video_guide =  sample[:,9999 :].clone()
-                    else:
-                        pre_video_guide =  sample[:, -reuse_frames:].clone()
-                num_frames_generated += sample.shape[1] 
 
+                # time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
+                # save_prompt = "_in_" + original_prompts[0]
+                # file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:50]).strip()}.mp4"
+                # sample = samples.cpu()
+                # cache_video( tensor=sample[None].clone(), save_file=os.path.join(save_path, file_name), fps=16, nrow=1, normalize=True, value_range=(-1, 1))
 
-                if prefix_video != None:
-                    if reuse_frames == 0:
-                        sample = torch.cat([ prefix_video[:, :], sample], dim = 1)
-                    else:
-                        sample = torch.cat([ prefix_video[:, :-reuse_frames], sample], dim = 1)
-                    prefix_video = None
-                if sliding_window and window_no > 1:
-                    if reuse_frames == 0:
-                        sample = sample[: , :]
-                    else:
-                        sample = sample[: , reuse_frames:]
-                    guide_start_frame -= reuse_frames 
-
-                exp = 0
-                if len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0:                
-                    progress_args = [(num_inference_steps , num_inference_steps) , status + " - Upsampling"  ,  num_inference_steps]
-                    send_cmd("progress", progress_args)
-
-                if temporal_upsampling == "rife2":
-                    exp = 1
-                elif temporal_upsampling == "rife4":
-                    exp = 2
-                output_fps = fps
-                if exp > 0: 
-                    from rife.inference import temporal_interpolation
-                    if sliding_window and window_no > 1:
-                        sample = torch.cat([previous_before_last_frame, sample], dim=1)
-                        previous_before_last_frame = sample[:, -2:-1].clone()
-                        sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
-                        sample = sample[:, 1:]
-                    else:
-                        sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
-                        previous_before_last_frame = sample[:, -2:-1].clone()
+                if samples == None:
+                    abort = True
+                    state["prompt"] = ""
+                    send_cmd("output")  
+                else:
+                    sample = samples.cpu()
+                    # if True: # for testing
+                    #     torch.save(sample, "output.pt")
+                    # else:
+                    #     sample =torch.load("output.pt")
+                    if gen.get("extra_windows",0) > 0:
+                        sliding_window = True 
+                    if sliding_window :
+                        guide_start_frame += current_video_length
+                        if discard_last_frames > 0:
+                            sample = sample[: , :-discard_last_frames]
+                            guide_start_frame -= discard_last_frames
+                        if reuse_frames == 0:
+                            pre_video_guide =  sample[:,9999 :].clone()
+                        else:
+                            pre_video_guide =  sample[:, -reuse_frames:].clone()
+                    num_frames_generated += sample.shape[1] 
 
-                    output_fps = output_fps * 2**exp
 
-                if len(spatial_upsampling) > 0:
-                    from wan.utils.utils import resize_lanczos # need multithreading or to do lanczos with cuda
-                    if spatial_upsampling == "lanczos1.5":
-                        scale = 1.5
-                    else:
-                        scale = 2
-                    sample = (sample + 1) / 2
-                    h, w = sample.shape[-2:]
-                    h *= scale
-                    w *= scale
-                    h = int(h)
-                    w = int(w)
-                    new_frames =[]
-                    for i in range( sample.shape[1] ):
-                        frame = sample[:, i]
-                        frame = resize_lanczos(frame, h, w)
-                        frame = frame.unsqueeze(1)
-                        new_frames.append(frame)
-                    sample = torch.cat(new_frames, dim=1)
-                    new_frames = None
-                    sample = sample * 2 - 1
-
-                if sliding_window :
-                    if frames_already_processed == None:
-                        frames_already_processed = sample
-                    else:
-                        sample = torch.cat([frames_already_processed, sample], dim=1)
-                    frames_already_processed = sample
+                    if prefix_video != None:
+                        if reuse_frames == 0:
+                            sample = torch.cat([ prefix_video[:, :], sample], dim = 1)
+                        else:
+                            sample = torch.cat([ prefix_video[:, :-reuse_frames], sample], dim = 1)
+                        prefix_video = None
+                    if sliding_window and window_no > 1:
+                        if reuse_frames == 0:
+                            sample = sample[: , :]
+                        else:
+                            sample = sample[: , reuse_frames:]
+                        guide_start_frame -= reuse_frames 
 
-                time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
-                save_prompt = original_prompts[0]
-                if os.name == 'nt':
-                    file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:50]).strip()}.mp4"
-                else:
-                    file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:100]).strip()}.mp4"
-                video_path = os.path.join(save_path, file_name)
+                    exp = 0
+                    if len(temporal_upsampling) > 0 or len(spatial_upsampling) > 0:                
+                        progress_args = [(num_inference_steps , num_inference_steps) , status + " - Upsampling"  ,  num_inference_steps]
+                        send_cmd("progress", progress_args)
 
-                if audio_guide == None:
-                    cache_video( tensor=sample[None], save_file=video_path, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
-                else:
-                    save_path_tmp = video_path[:-4] + "_tmp.mp4"
-                    cache_video( tensor=sample[None], save_file=save_path_tmp, fps=output_fps, nrow=1, normalize=True, value_range=(-1, 1))
-                    final_command = [ "ffmpeg", "-y", "-i", save_path_tmp, "-i", audio_guide, "-c:v", "libx264", "-c:a", "aac", "-shortest", "-loglevel", "warning", "-nostats", video_path, ]
-                    import subprocess
-                    subprocess.run(final_command, check=True)
-                    os.remove(save_path_tmp)
-
-                end_time = time.time()
-
-                inputs = get_function_arguments(generate_video, locals())
-                inputs.pop("send_cmd")
-                inputs.pop("task")
-                configs = prepare_inputs_dict("metadata", inputs)
-                configs["prompt"] = "\n".join(original_prompts)
-                if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0:
-                    configs["enhanced_prompt"] = "\n".join(prompts)
-                configs["generation_time"] = round(end_time-start_time)
-                metadata_choice = server_config.get("metadata_type","metadata")
-                if metadata_choice == "json":
-                    with open(video_path.replace('.mp4', '.json'), 'w') as f:
-                        json.dump(configs, f, indent=4)
-                elif metadata_choice == "metadata":
-                    from mutagen.mp4 import MP4
-                    file = MP4(video_path)
-                    file.tags['©cmt'] = [json.dumps(configs)]
-                    file.save()
-
-                print(f"New video saved to Path: "+video_path)
-                file_list.append(video_path)
-                file_settings_list.append(configs)
+                    if temporal_upsampling == "rife2":
+                        exp = 1
+                    elif temporal_upsampling == "rife4":
+                        exp = 2
+                    output_fps = fps
+                    if exp > 0: 
+                        from rife.inference import temporal_interpolation
+                        if sliding_window and window_no > 1:
+                            sample = torch.cat([previous_before_last_frame, sample], dim=1)
+                            previous_before_last_frame = sample[:, -2:-1].clone()
+                            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
+                            sample = sample[:, 1:]
+                        else:
+                            sample = temporal_interpolation( os.path.join("ckpts", "flownet.pkl"), sample, exp, device=processing_device)
+                            previous_before_last_frame = sample[:, -2:-1].clone()
 
-                send_cmd("output")
+                        output_fps = output_fps * 2**exp
 
+                    if len(spatial_upsampling) > 0:
+                        from wan.utils.utils import resize_lanczos_video
+                        if spatial_upsampling == "lanczos1.5":
+                            scale = 1.5
+                        else:
+                            scale = 2
+                        sample = (sample + 1) / 2
+                        h, w = sample.shape[-2:]
+                        h *= scale
+                        w *= scale
+                        h = int(h)
+                        w = int(w)
+                        sample = resize_lanczos_video(sample, h, w, device=processing_device)
+                        sample = sample * 2 - 1
+
+                    time_flag = datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d-%Hh%Mm%Ss")
+                    save_prompt = original_prompts[0]
+                    if os.name == 'nt':
+                        file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:50]).strip()}.mp4"
+                    else:
+                        file_name = f"{time_flag}_seed{seed}_{sanitize_file_name(save_prompt[:100]).strip()}.mp4"
+                    video_path = os.path.join(save_path, file_name)
+                    end_time = time.time()
+
+                    inputs = get_function_arguments(generate_video, locals())
+                    inputs.pop("send_cmd")
+                    inputs.pop("task")
+                    configs = prepare_inputs_dict("metadata", inputs)
+                    configs["prompt"] = "\n".join(original_prompts)
+                    if prompt_enhancer_image_caption_model != None and prompt_enhancer !=None and len(prompt_enhancer)>0:
+                        configs["enhanced_prompt"] = "\n".join(prompts)
+                    configs["generation_time"] = round(end_time-start_time)
+
+                    # every window is encoded as a separate segment (only its new frames), the video is assembled once the last window is done
+                    if video_segments_dir == None:
+                        video_segments_dir = tempfile.mkdtemp(prefix="wgp_segments_")
+                    segment_path = os.path.join(video_segments_dir, f"segment_{len(video_segments):04d}.mp4")
+
+                    # the segment is encoded in the background while the next window / task is generated, previous writes are completed first to keep the gallery order
+                    wait_for_video_writers()
+                    video_writer = VideoStreamWriter(segment_path, fps=output_fps, normalize=True, value_range=(-1, 1))
+                    video_writer.write(sample)
+                    video_writer.close(wait = False)
+                    pending_video_writers.append(video_writer)
+                    video_segments.append(video_writer)
+            if len(video_segments) > 0:
+                # an aborted generation still produces the windows completed so far
+                video_finalizer = threading.Thread(target=finalize_video, args=(video_segments, video_segments_dir, video_path, configs), daemon=True)
+                video_segments_dir = None
+                video_finalizer.start()
+                pending_video_writers.append(video_finalizer)
+        finally:
+            if video_segments_dir != None:
+                wait_for_video_writers()
+                shutil.rmtree(video_segments_dir, ignore_errors= True)
         seed += 1
+    if hasattr(trans, "release_teacache_buffers"):
+        trans.release_teacache_buffers()
     clear_status(state)
     if temp_filename!= None and  os.path.isfile(temp_filename):
         os.remove(temp_filename)
@@ -3368,10 +3770,7 @@ def prepare_generate_video(state):
     else:
         return gr.Button(visible= False), gr.Button(visible= True), gr.Column(visible= True)
 
-def generate_preview(latents):
-    import einops
-
-    model_family = get_model_family(transformer_filename)
+def get_latent_rgb_factors(model_family):
     if model_family == "wan":
         latent_channels = 16
         latent_dimensions = 3
@@ -3561,33 +3960,63 @@ def generate_preview(latents):
         latent_rgb_factors_bias = [ 0.0259, -0.0192, -0.0761]        
     else:
         raise Exception("preview not supported")
-    latents = latents.unsqueeze(0) 
-    nb_latents = latents.shape[2]
-    latents_to_preview = 4
-    latents_to_preview = min(nb_latents, latents_to_preview)
-    skip_latent =  nb_latents / latents_to_preview
-    latent_no = 0
-    selected_latents = []
-    while latent_no < nb_latents:
-        selected_latents.append( latents[:, : , int(latent_no): int(latent_no)+1])
-        latent_no += skip_latent 
-
-    latents = torch.cat(selected_latents, dim = 2)
-    weight = torch.tensor(latent_rgb_factors, device=latents.device, dtype=latents.dtype).transpose(0, 1)[:, :, None, None, None]
-    bias = torch.tensor(latent_rgb_factors_bias, device=latents.device, dtype=latents.dtype)
-
-    images = torch.nn.functional.conv3d(latents, weight, bias=bias, stride=1, padding=0, dilation=1, groups=1)
-    images = images.add_(1.0).mul_(127.5)
-    images = images.detach().cpu()
-    if images.dtype == torch.bfloat16:
-        images = images.to(torch.float16)
-    images = images.numpy().clip(0, 255).astype(np.uint8)
-    images = einops.rearrange(images, 'b c t h w -> (b h) (t w) c')
-    h, w, _ = images.shape
-    scale = 200 / h
-    images= Image.fromarray(images)
-    images = images.resize(( int(w*scale),int(h*scale)), resample=Image.Resampling.BILINEAR) 
-    return images
+    return latent_rgb_factors, latent_rgb_factors_bias
+
+latent_rgb_projections = {}
+preview_streams = {}
+
+def get_latent_rgb_projection(model_family, device, dtype):
+    # projection matrices are built once per model family / device / dtype and stay on the device
+    key = (model_family, str(device), dtype)
+    projection = latent_rgb_projections.get(key, None)
+    if projection == None:
+        latent_rgb_factors, latent_rgb_factors_bias = get_latent_rgb_factors(model_family)
+        weight = torch.tensor(latent_rgb_factors, device=device, dtype=dtype).transpose(0, 1)
+        bias = torch.tensor(latent_rgb_factors_bias, device=device, dtype=dtype)
+        projection = (weight, bias)
+        latent_rgb_projections[key] = projection
+    return projection
+
+def compute_preview(latents, model_family, preview_height = 200):
+    # latents: c, t, h, w -> uint8 image h, (t w), c made of up to 4 frames, computed on the latents device
+    nb_latents = latents.shape[1]
+    latents_to_preview = min(nb_latents, 4)
+    frame_nos = [int(i * nb_latents / latents_to_preview) for i in range(latents_to_preview)]
+    weight, bias = get_latent_rgb_projection(model_family, latents.device, latents.dtype)
+    images = torch.einsum("rc,cthw->trhw", weight, latents[:, frame_nos]) + bias[None, :, None, None]
+    images = images.float().add_(1.0).mul_(127.5)
+    h, w = images.shape[-2:]
+    scale = preview_height / h
+    images = torch.nn.functional.interpolate(images, size=(preview_height, int(w*scale)), mode="bilinear", align_corners=False)
+    return images.clamp_(0, 255).to(torch.uint8).permute(2, 0, 3, 1).flatten(1, 2)
+
+def prepare_preview(latents, model_family):
+    # called from the generation thread: the preview is computed on a side stream so that no denoising step waits for it
+    if latents.device.type != "cuda":
+        return compute_preview(latents, model_family).cpu(), None
+    device = latents.device
+    stream = preview_streams.get(str(device), None)
+    if stream == None:
+        stream = torch.cuda.Stream(device)
+        preview_streams[str(device)] = stream
+    # the denoising loop keeps updating the latents in place, the side stream reads a snapshot taken on the main stream
+    latents = latents.clone()
+    stream.wait_stream(torch.cuda.current_stream(device))
+    with torch.cuda.stream(stream):
+        latents.record_stream(stream)
+        images = compute_preview(latents, model_family)
+        images_cpu = torch.empty(images.shape, dtype=torch.uint8, pin_memory=True)
+        images_cpu.copy_(images, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record(stream)
+    return images_cpu, event
+
+def generate_preview(preview):
+    # called from the UI thread, only waits for the preview computation itself
+    images, event = preview
+    if event != None:
+        event.synchronize()
+    return Image.fromarray(images.numpy())
 
 
 def process_tasks(state):
@@ -3628,6 +4057,10 @@ def process_tasks(state):
     gen["status"] = "Generating Video"
     yield time.time(), time.time() 
     prompt_no = 0
+    # a single stream for all the tasks: the videos are written in the background and the "output" command of the last
+    # video of a task is usually sent after its "exit", it is then processed while the next task is running
+    com_stream = AsyncStream()
+    send_cmd = com_stream.output_queue.push
     while len(queue) > 0:
         prompt_no += 1
         gen["prompt_no"] = prompt_no
@@ -3635,8 +4068,6 @@ def process_tasks(state):
         task_id = task["id"] 
         params = task['params']
 
-        com_stream = AsyncStream()
-        send_cmd = com_stream.output_queue.push
         def generate_video_error_handler():
             try:
                 generate_video(task, send_cmd,  **params)
@@ -3672,7 +4103,6 @@ def process_tasks(state):
                 gen["progress_args"] = data
                 # progress(*data)
             elif cmd == "preview":
-                torch.cuda.current_stream().synchronize()
                 preview= None if data== None else generate_preview(data) 
                 gen["preview"] = preview
                 yield time.time() , gr.Text()
@@ -3687,8 +4117,13 @@ def process_tasks(state):
             gen["status"] = status
 
         queue[:] = [item for item in queue if item['id'] != task['id']]
+        schedule_queue(queue, task["params"], start = 0)
         update_global_queue_ref(queue)
 
+    if len(pending_video_writers) > 0:
+        wait_for_video_writers()
+        yield time.time() , time.time() 
+
     gen["prompts_max"] = 0
     gen["prompt"] = ""
     end_time = time.time()
@@ -3699,6 +4134,173 @@ def process_tasks(state):
     gen["status"] = status
     gen["status_display"] =  False
 
+def log_batch_event(progress_file, event, task_id = None, **data):
+    # events are printed and appended as json lines to progress_file, so that another process can follow the batch
+    details = ", ".join(f"{k}: {v}" for k, v in data.items())
+    print(f"[batch] {event}" + ("" if task_id == None else f" (task {task_id})") + ("" if len(details) == 0 else f" {details}"))
+    if progress_file != None:
+        record = {"time": round(time.time(), 3), "event": event, "task": task_id}
+        record.update(data)
+        with open(progress_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+def process_tasks_headless(state, progress_file = None):
+    # same loop as process_tasks without the web interface, a failed task doesn't prevent the next ones from running
+    from wan.utils.thread_utils import AsyncStream, async_run
+    global gen_in_progress, preview_interval
+
+    gen = get_gen_info(state)
+    queue = gen["queue"]
+    gen["file_list"] = []
+    gen["file_settings_list"] = []
+    gen["prompts_max"] = len(queue)
+    # previews are only displayed by the web interface
+    preview_interval = float("inf")
+    schedule_queue(queue, start = 0)
+
+    loras_lists = {}
+    failed_tasks = 0
+    abort = False
+    prompt_no = 0
+    start_time = time.time()
+    gen_in_progress = True
+    gen["in_progress"] = True
+    log_batch_event(progress_file, "batch_start", tasks = len(queue))
+    while len(queue) > 0 and not abort:
+        prompt_no += 1
+        gen["prompt_no"] = prompt_no
+        task = queue[0]
+        params = task['params']
+        try:
+            model_filename = params["model_filename"]
+            lora_dir = get_lora_dir(model_filename)
+            if not lora_dir in loras_lists:
+                loras_lists[lora_dir] = setup_loras(model_filename, None, lora_dir, "", None)[0]
+        except Exception as e:
+            traceback.print_exc()
+            failed_tasks += 1
+            log_batch_event(progress_file, "task_error", task["id"], error = str(e))
+            queue[:] = [item for item in queue if item['id'] != task['id']]
+            continue
+        state["model_filename"] = model_filename
+        state["loras"] = loras_lists[lora_dir]
+        params["state"] = state
+
+        log_batch_event(progress_file, "task_start", task["id"], model = get_model_name(model_filename), prompt = params.get("prompt", ""))
+        files_count = len(gen["file_list"])
+        task_start_time = time.time()
+        error = None
+
+        com_stream = AsyncStream()
+        send_cmd = com_stream.output_queue.push
+        def generate_video_error_handler():
+            try:
+                generate_video(task, send_cmd,  **params)
+            except Exception as e:
+                tb = traceback.format_exc().split('\n')[:-1]
+                print('\n'.join(tb))
+                send_cmd("error",str(e))
+            finally:
+                send_cmd("exit", None)
+
+        async_run(generate_video_error_handler)
+
+        while True:
+            try:
+                cmd, data = com_stream.output_queue.next()
+            except KeyboardInterrupt:
+                # the current generation is interrupted and the remaining tasks are not run
+                log_batch_event(progress_file, "abort", task["id"])
+                abort = True
+                gen["abort"] = True
+                if wan_model != None:
+                    wan_model._interrupt = True
+                continue
+            if cmd == "exit":
+                break
+            elif cmd == "error":
+                error = str(data)
+            elif cmd == "info" or cmd == "status":
+                log_batch_event(progress_file, cmd, task["id"], status = data)
+            elif cmd == "progress":
+                if len(data) > 2:
+                    (step_no, steps), status = data[0], data[1]
+                    log_batch_event(progress_file, "progress", task["id"], step = step_no, steps = steps, status = status)
+                else:
+                    log_batch_event(progress_file, "progress", task["id"], status = data[1])
+
+        # the videos are encoded in the background, they are only reported once written
+        wait_for_video_writers()
+        for file_path in gen["file_list"][files_count:]:
+            log_batch_event(progress_file, "output", task["id"], path = file_path)
+        if error != None:
+            failed_tasks += 1
+            log_batch_event(progress_file, "task_error", task["id"], error = error)
+        else:
+            log_batch_event(progress_file, "task_end", task["id"], files = len(gen["file_list"]) - files_count, time = round(time.time() - task_start_time, 1))
+
+        gen["abort"] = False
+        queue[:] = [item for item in queue if item['id'] != task['id']]
+        schedule_queue(queue, task["params"], start = 0)
+
+    gen_in_progress = False
+    gen["in_progress"] = False
+    gen["prompts_max"] = 0
+    log_batch_event(progress_file, "batch_end", files = len(gen["file_list"]), failed = failed_tasks, remaining = len(queue), time = round(time.time() - start_time, 1))
+    if abort:
+        raise KeyboardInterrupt
+    return failed_tasks + len(queue)
+
+def run_batch(job_files, progress_file = None):
+    # job files are queue zips saved by the web interface or task json files, returns the number of tasks that have not been completed
+    global task_id
+    state = {"gen": {"queue": []}, "model_filename": transformer_filename, "loras": [], "advanced": True}
+    queue = get_gen_info(state)["queue"]
+    loaded_cache_dir = os.path.join(save_path, "_loaded_queue_cache")
+    failed_jobs = 0
+    for job_file in job_files:
+        try:
+            if job_file.endswith(".zip"):
+                tasks = read_queue_file(job_file, state, loaded_cache_dir)
+            else:
+                tasks = read_task_file(job_file, state, loaded_cache_dir)
+        except Exception as e:
+            traceback.print_exc()
+            log_batch_event(progress_file, "job_error", file = job_file, error = str(e))
+            failed_jobs += 1
+            continue
+        # ids of different job files may collide
+        for task in tasks:
+            task_id += 1
+            task["id"] = task_id
+        queue += tasks
+        log_batch_event(progress_file, "job_loaded", file = job_file, tasks = len(tasks))
+    return failed_jobs + process_tasks_headless(state, progress_file)
+
+def get_batch_job_files(folder):
+    job_files = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith((".zip", ".json"))]
+    return sorted([f for f in job_files if os.path.isfile(f)], key = os.path.getmtime)
+
+def watch_batch_folder(folder, progress_file = None, poll_interval = 5):
+    # job files dropped in the folder are run in their arrival order and then moved to its 'done' or 'failed' subfolder
+    for subfolder in ("done", "failed"):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+    log_batch_event(progress_file, "watch", folder = folder)
+    while True:
+        # files that have been modified recently may still be being copied
+        job_files = [f for f in get_batch_job_files(folder) if time.time() - os.path.getmtime(f) >= poll_interval]
+        if len(job_files) == 0:
+            time.sleep(poll_interval)
+            continue
+        job_file = job_files[0]
+        try:
+            failed = run_batch([job_file], progress_file)
+        except Exception as e:
+            # a job that can't be run must not stop the daemon nor be picked up again
+            traceback.print_exc()
+            log_batch_event(progress_file, "job_error", file = job_file, error = str(e))
+            failed = 1
+        shutil.move(job_file, os.path.join(folder, "failed" if failed > 0 else "done", os.path.basename(job_file)))
 
 
 def get_generation_status(prompt_no, prompts_max, repeat_no, repeat_max, window_no, total_windows):
@@ -4132,6 +4734,11 @@ def prepare_inputs_dict(target, inputs ):
     if not "hunyuan" in model_filename:
         inputs.pop("embedded_guidance_scale")
 
+    if "hunyuan" in model_filename or "ltxv" in model_filename:
+        unsaved_params = ["fbc_setting", "fbc_layers", "fbc_start_step_perc"]
+        for k in unsaved_params:
+            inputs.pop(k)
+
     if target == "metadata":
         inputs = {k: v for k,v in inputs.items() if v != None  }
 
@@ -4240,6 +4847,9 @@ def save_inputs(
             multi_images_gen_type,
             tea_cache_setting,
             tea_cache_start_step_perc,
+            fbc_setting,
+            fbc_layers,
+            fbc_start_step_perc,
             loras_choices,
             loras_multipliers,
             image_prompt_type,
@@ -4335,7 +4945,10 @@ def handle_celll_selection(state, evt: gr.SelectData):
         if col_index == 6: cell_value = "↑"
         elif col_index == 7: cell_value = "↓"
         elif col_index == 8: cell_value = "✖"
-    if col_index == 6:
+    if col_index == 10:
+        new_df_data = cycle_task_priority(queue, [row_index])
+        return new_df_data, gr.update(), gr.update(visible=False)
+    elif col_index == 6:
         new_df_data = move_up(queue, [row_index])
         return new_df_data, gr.update(), gr.update(visible=False)
     elif col_index == 7:
@@ -4388,27 +5001,22 @@ def preload_model_when_switching(state):
     if "S" in preload_model_policy:
         model_filename = state["model_filename"] 
         if  state["model_filename"] !=  transformer_filename:
-            wan_model = None
-            if offloadobj is not None:
-                offloadobj.release()
-                offloadobj = None
-            gc.collect()
+            release_current_model(keep_warm = not reload_needed)
+            if reload_needed:
+                model_pool.release_all()
             yield f"Loading model {get_model_name(model_filename)}..."
-            wan_model, offloadobj, _ = load_models(model_filename)
+            wan_model, offloadobj, _ = acquire_model(model_filename)
             yield f"Model loaded"
             reload_needed=  False 
         return   
     return gr.Text()
 
 def unload_model_if_needed(state):
-    global reload_needed, wan_model, offloadobj
+    global reload_needed
     if "U" in preload_model_policy:
         if wan_model != None:
-            wan_model = None
-            if offloadobj is not None:
-                offloadobj.release()
-                offloadobj = None
-            gc.collect()
+            release_current_model()
+            model_pool.release_all()
             reload_needed=  True
 
 def filter_letters(source_str, letters):
@@ -4848,6 +5456,26 @@ def generate_video_tab(update_form = False, state_dict = None, ui_defaults = Non
                         )
                         tea_cache_start_step_perc = gr.Slider(0, 100, value=ui_defaults.get("tea_cache_start_step_perc",0), step=1, label="Tea Cache starting moment in % of generation") 
 
+                    with gr.Column(visible = not (hunyuan_i2v or hunyuan_t2v or hunyuan_video_custom or hunyuan_video_avatar or ltxv)):
+                        gr.Markdown("<B>First Block Cache computes only the first blocks of the model when their output barely changes from the last fully computed step and reuses the output of the others (ignored if Tea Cache is enabled)</B>")
+                        with gr.Row():
+                            fbc_setting = gr.Dropdown(
+                                choices=[
+                                    ("First Block Cache Disabled", 0),
+                                    ("Threshold 0.05 (best quality)", 0.05), 
+                                    ("Threshold 0.08", 0.08), 
+                                    ("Threshold 0.10", 0.10), 
+                                    ("Threshold 0.12", 0.12), 
+                                    ("Threshold 0.15 (fastest)", 0.15), 
+                                ],
+                                value=float(ui_defaults.get("fbc_setting",0)),
+                                visible=True,
+                                scale = 2,
+                                label="First Block Cache Threshold"
+                            )
+                            fbc_layers = gr.Slider(1, 8, value=ui_defaults.get("fbc_layers",1), step=1, label="Number of first Blocks always computed", scale = 1) 
+                        fbc_start_step_perc = gr.Slider(0, 100, value=ui_defaults.get("fbc_start_step_perc",10), step=1, label="First Block Cache starting moment in % of generation") 
+
                 with gr.Tab("Upsampling"):
 
                     with gr.Column():
@@ -4981,11 +5609,11 @@ def generate_video_tab(update_form = False, state_dict = None, ui_defaults = Non
                 with gr.Accordion("Queue Management", open=False) as queue_accordion:
                     with gr.Row( ): 
                         queue_df = gr.DataFrame(
-                            headers=["Qty","Prompt", "Length","Steps","", "", "", "", ""],
-                            datatype=[ "str","markdown","str", "markdown", "markdown", "markdown", "str", "str", "str"],
-                            column_widths= ["5%", None, "7%", "7%", "10%", "10%", "3%", "3%", "34"],
+                            headers=["Qty","Prompt", "Length","Steps","", "", "", "", "", "Switch", "Pri"],
+                            datatype=[ "str","markdown","str", "markdown", "markdown", "markdown", "str", "str", "str", "markdown", "str"],
+                            column_widths= ["5%", None, "7%", "7%", "10%", "10%", "3%", "3%", "34", "8%", "3%"],
                             interactive=False,
-                            col_count=(9, "fixed"),
+                            col_count=(11, "fixed"),
                             wrap=True,
                             value=[],
                             line_breaks= True,
@@ -5348,6 +5976,7 @@ def generate_configuration_tab(state, blocks, header, model_choice, prompt_enhan
                 attention_choice = gr.Dropdown(
                     choices=[
                         ("Auto : pick sage2 > sage > sdpa depending on what is installed", "auto"),
+                        ("Autotune : time once per attention shape the installed attention types and use the fastest one", "autotune"),
                         ("Scale Dot Product Attention: default, always available", "sdpa"),
                         ("Flash" + check("flash")+ ": good quality - requires additional install (usually complex to set up on Windows without WSL)", "flash"),
                         ("Xformers" + check("xformers")+ ": good quality - requires additional install (usually complex, may consume less VRAM to set up on Windows without WSL)", "xformers"),
@@ -5504,6 +6133,54 @@ def generate_configuration_tab(state, blocks, header, model_choice, prompt_enhan
                 )
                 preload_in_VRAM_choice = gr.Slider(0, 40000, value=server_config.get("preload_in_VRAM", 0), step=100, label="Number of MB of Models that are Preloaded in VRAM (0 will use Profile default)")
 
+                lora_bake_mode_choice = gr.Dropdown(
+                    choices=[
+                        ("Off, Loras are applied at each step", 0),
+                        ("On, Loras with constant multipliers are merged once in the non quantized Transformer weights and cached on disk", 1),
+                    ],
+                    value=server_config.get("lora_bake_mode", 0),
+                    label="Bake Loras (faster steps, the model is reloaded when switching to another Lora combination)"
+                )
+                lora_bake_cache_size_choice = gr.Slider(0, 262144, value=server_config.get("lora_bake_cache_size", 32768), step=1024, label="Number of MB of disk space used to cache the Baked Loras weights (0 to disable the cache)")
+                model_pool_size_choice = gr.Slider(0, 256000, value=server_config.get("model_pool_size", 0), step=1000, label="Number of MB of RAM used to keep previously used Models loaded, switching back to them will not reload them from disk (0 to disable)")
+
+                queue_scheduling_choice = gr.Dropdown(
+                    choices=[
+                        ("In the order the tasks have been added", 0),
+                        ("Grouped by Model / Loras / Resolution to reduce reloads (use the Pri column of the queue to prioritize ▲ or pin 📌 a task)", 1),
+                    ],
+                    value=server_config.get("queue_scheduling", 0),
+                    label="Queue Scheduling"
+                )
+                preprocessing_cache_size_choice = gr.Slider(0, 65536, value=server_config.get("preprocessing_cache_size", 2048), step=256, label="Number of MB of disk space used to cache the processed Control Videos (pose / depth / gray), 0 to disable")
+                text_encoder_cache_size_choice = gr.Slider(0, 1024, value=server_config.get("text_encoder_cache_size", 64), step=8, label="Number of Prompts whose Text Encoder output is kept in RAM, a prompt already encoded is not encoded again (0 to disable)")
+                text_encoder_disk_cache_choice = gr.Dropdown(
+                    choices=[
+                        ("Off", 0),
+                        ("On, the Text Encoder outputs are also saved in ckpts/cache/text_embeddings and reused after a restart", 1),
+                    ],
+                    value=server_config.get("text_encoder_disk_cache", 0),
+                    label="Text Encoder Disk Cache"
+                )
+                preview_interval_choice = gr.Slider(0, 10, value=server_config.get("preview_interval", 1.0), step=0.25, label="Minimum number of seconds between two Previews of the Generation (a higher value reduces the time spent decoding Previews)")
+                teacache_residual_dtype_choice = gr.Dropdown(
+                    choices=[
+                        ("Same as the Model (best quality)", ""),
+                        ("16 bits (bf16), halves the VRAM used by Tea Cache when the Model computes in float32", "bf16"),
+                        ("16 bits (fp16)", "fp16"),
+                    ],
+                    value=server_config.get("teacache_residual_dtype", ""),
+                    label="Precision of the Residuals stored by Tea Cache"
+                )
+                cross_attn_kv_cache_choice = gr.Dropdown(
+                    choices=[
+                        ("Off", 0),
+                        ("On, the projected Keys / Values of the Text Prompt are computed once per Generation instead of at each step (uses some VRAM)", 1),
+                    ],
+                    value=server_config.get("cross_attn_kv_cache", 0),
+                    label="Cross Attention Cache (Wan models)"
+                )
+
 
 
         
@@ -5531,7 +6208,17 @@ def generate_configuration_tab(state, blocks, header, model_choice, prompt_enhan
                     UI_theme_choice,
                     enhancer_enabled_choice,
                     fit_canvas_choice,
-                    preload_in_VRAM_choice
+                    preload_in_VRAM_choice,
+                    lora_bake_mode_choice,
+                    model_pool_size_choice,
+                    queue_scheduling_choice,
+                    preprocessing_cache_size_choice,
+                    text_encoder_cache_size_choice,
+                    text_encoder_disk_cache_choice,
+                    preview_interval_choice,
+                    teacache_residual_dtype_choice,
+                    cross_attn_kv_cache_choice,
+                    lora_bake_cache_size_choice
                 ],
                 outputs= [msg , header, model_choice, prompt_enhancer_row]
         )
@@ -6001,8 +6688,22 @@ def create_ui():
         return main
 
 if __name__ == "__main__":
-    atexit.register(autosave_queue)
     download_ffmpeg()
+    if len(args.output_dir) > 0:
+        save_path = args.output_dir
+    if len(args.process) > 0 or len(args.watch) > 0:
+        progress_file = args.progress_jsonl if len(args.progress_jsonl) > 0 else None
+        try:
+            if len(args.watch) > 0:
+                watch_batch_folder(args.watch, progress_file)
+            elif os.path.isdir(args.process):
+                failed = run_batch(get_batch_job_files(args.process), progress_file)
+            else:
+                failed = run_batch([args.process], progress_file)
+        except KeyboardInterrupt:
+            failed = 1
+        sys.exit(1 if failed > 0 else 0)
+    atexit.register(autosave_queue)
     # threading.Thread(target=runner, daemon=True).start()
     os.environ["GRADIO_ANALYTICS_ENABLED"] = "False"
     server_port = int(args.server_port)